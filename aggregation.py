@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+
+# Time-bucketed summaries (hourly means, daily sea surface
+# temperature, ...) of White Shark Pa'ina tag data for all
+# sharks in one pass. Rows are grouped on integer group ids
+# built from the shark Id and a floored datetime, and
+# results are broadcast back to rows by indexing instead of
+# merging on formatted date strings.
+
+HOURLY_METRICS = {
+    'Depth(m)': 'Mean Hourly Depth (m)',
+    'External Temp (c)': 'Mean Hourly External Temp (c)',
+    'Speed (m/s)': 'Mean Hourly Speed (m/s)',
+    'Is non-zero VV': 'Hourly Diving Ratio',
+    }
+
+
+def get_time_buckets(datetimes, freq="h"):
+    """
+    Given a Series of tz-aware datetimes and a pandas
+    frequency string (e.g. "h" for hour, "D" for day or
+    "15min"), returns a numpy datetime64 array of the wall
+    clock start of each datetime's time bucket.
+    """
+    wall = pd.Series(datetimes).dt.tz_localize(None)
+    return wall.dt.floor(freq).to_numpy()
+
+
+def get_group_ids(df, freq="h", by="Id"):
+    """
+    Given a dataframe with a "Datetime (UTC-10)" column, a
+    pandas frequency string and the column to group sharks
+    by (None if df holds one shark), returns an int array
+    with each row's group id and a dataframe of the by value
+    and "Bucket Start" of each group, in group id order.
+    Rows with a missing by value or datetime get group id -1
+    and are in no group.
+    """
+    if by is None:
+        shark_codes, sharks = np.zeros(len(df), dtype=np.int64), None
+    else:
+        shark_codes, sharks = pd.factorize(df[by])
+    bucket_codes, buckets = pd.factorize(get_time_buckets(df["Datetime (UTC-10)"], freq))
+    has_group = (shark_codes >= 0) & (bucket_codes >= 0)
+    group_ids = np.full(len(df), -1, dtype=np.int64)
+    group_ids[has_group], keys = pd.factorize(shark_codes[has_group].astype(np.int64) * len(buckets)
+                                              + bucket_codes[has_group])
+
+    tz = df["Datetime (UTC-10)"].dt.tz
+    groups = pd.DataFrame({
+        "Bucket Start": pd.DatetimeIndex(buckets[keys % len(buckets)]).tz_localize(tz),
+        })
+    if by is not None:
+        groups.insert(0, by, np.asarray(sharks)[keys // len(buckets)])
+    return group_ids, groups
+
+
+def group_by_ids(values, group_ids):
+    """
+    Given a dataframe or Series and its rows' group ids from
+    get_group_ids, returns its groupby on the group ids in id
+    order, leaving out rows in no group.
+    """
+    has_group = group_ids >= 0
+    return values[has_group].groupby(group_ids[has_group], sort=True)
+
+
+def broadcast_groups(values, group_ids):
+    """
+    Given an array (or dataframe) with a value (or row) per
+    group and rows' group ids from get_group_ids, returns a
+    float array of each row's group value, NaN for rows in
+    no group.
+    """
+    values = np.asarray(values, dtype=float)
+    missing = np.full((1,) + values.shape[1:], np.nan)
+    # id -1 takes the appended NaN
+    return np.concatenate([values, missing])[group_ids]
+
+
+def aggregate_by_time(df, columns, freq="h", reducer="mean", by="Id"):
+    """
+    Given a dataframe with a "Datetime (UTC-10)" column, a
+    list of columns, a pandas frequency string, a reducer
+    ("mean", "sum", "count", "min", "max", "first", ...) and
+    the column to group sharks by, returns a tidy dataframe
+    with one row per shark and time bucket holding the
+    reduced columns.
+    """
+    group_ids, groups = get_group_ids(df, freq, by)
+    reduced = group_by_ids(df[columns], group_ids).agg(reducer)
+    return pd.concat([groups, reduced.reset_index(drop=True)], axis=1)
+
+
+def broadcast_by_time(df, columns, freq="h", reducer="mean", by="Id"):
+    """
+    Given the same arguments as aggregate_by_time, returns a
+    dataframe with the same index as df where each row holds
+    the reduced values of its shark and time bucket.
+    """
+    group_ids, _ = get_group_ids(df, freq, by)
+    reduced = group_by_ids(df[columns], group_ids).agg(reducer)
+    return pd.DataFrame(broadcast_groups(reduced, group_ids), index=df.index, columns=columns)
+
+
+@instrument()
+def add_hourly_metrics(df):
+    """
+    Given a dataframe of one or more sharks with depth,
+    external temperature, vertical velocity and speed
+    columns, adds mean hourly depth, temperature and speed
+    columns and the hourly diving ratio: the fraction of
+    samples in the hour with non-zero vertical velocity
+    (Andrzejaczek et al., 2020).
+    """
+    velocity = df['Vertical Velocity (m/s)']
+    values = df[['Id', 'Datetime (UTC-10)', 'Depth(m)', 'External Temp (c)', 'Speed (m/s)']].copy()
+    values['Is non-zero VV'] = (velocity != 0).astype(float).where(velocity.notna())
+
+    hourly = broadcast_by_time(values, list(HOURLY_METRICS), "h")
+    for col, name in HOURLY_METRICS.items():
+        df[name] = hourly[col]
+    return df
+
+
+@instrument()
+def add_daily_sst(df, max_depth=5):
+    """
+    Given a dataframe of one or more sharks with depth and
+    external temperature columns, adds a daily sea surface
+    temperature estimate: the mean temperature of samples in
+    the top max_depth meters that day (Andrzejaczek et al.,
+    2018a). Days the shark did not come that shallow use the
+    estimate from the previous day.
+    """
+    surface_temps = df['External Temp (c)'].where(df['Depth(m)'] <= max_depth)
+    group_ids, groups = get_group_ids(df, "D")
+    groups['Daily SST Est (c)'] = group_by_ids(surface_temps, group_ids).mean().to_numpy()
+
+    # fill days without surface samples from the shark's previous day
+    groups = groups.sort_values(['Id', 'Bucket Start'])
+    groups['Daily SST Est (c)'] = groups.groupby('Id', sort=False, observed=True)['Daily SST Est (c)'].ffill()
+    df['Daily SST Est (c)'] = broadcast_groups(groups['Daily SST Est (c)'].sort_index(), group_ids)
+    return df
@@ -0,0 +1,328 @@
+import json
+import matplotlib.pyplot as plt
+import numpy as np
+from os.path import exists, join
+import pandas as pd
+import platform
+import sys
+import tempfile
+import time
+
+import aggregation
+import cleaning
+import figures
+from geolocation import add_positions
+from lunar import add_moon_phase
+import tag_formats
+import time_of_day
+from time_of_day import get_times_of_day, get_times_of_day_astral
+
+
+# Written for timing the White Shark Pa'ina processing
+# steps on synthetic archival tag data, e.g.
+# python3 benchmarks.py datetime 5000000
+# python3 benchmarks.py ingest 8 500000
+# python3 benchmarks.py stages 20000 10 UTC
+# The stages benchmark times each pipeline stage at 1x, 10x
+# and 100x a base number of rows, writes the timings to
+# benchmark_results.json and reports stages that got slower
+# than benchmark_baseline.json (written by "baseline" in
+# place of "stages" on the machine being compared).
+
+# multiples of the base number of rows the stages are timed at
+STAGE_SCALES = (1, 10, 100)
+
+BASELINE_PATH = "benchmark_baseline.json"
+
+RESULTS_PATH = "benchmark_results.json"
+
+# stages this many times slower than the baseline (per row)
+# are reported as regressions
+REGRESSION_TOLERANCE = 1.5
+
+
+# synthetic data ##########################################
+def make_synthetic_tag_data(num_rows, sample_period_sec=10, tag_format="UTC", seed=0):
+    """
+    Given a number of rows, a sampling period in seconds, the
+    name of a tag format in tag_formats.TAG_FORMATS and a
+    random seed, returns a pandas dataframe laid out like a
+    corrected archival tag file of that format. Depths follow
+    a diel pattern (deep by day, shallow at night and a little
+    deeper near the full moon) with dives of tens of meters
+    on top, and temperatures follow depth through a
+    thermocline.
+    """
+    tag_format = tag_formats.TAG_FORMATS[tag_format]
+    start = pd.Timestamp("2019-10-01 00:00:00", tz="Pacific/Honolulu")
+    times = start + pd.to_timedelta(np.arange(num_rows) * sample_period_sec, unit="s")
+    hours = np.arange(num_rows) * sample_period_sec / 3600
+
+    # 0 at night, 1 by day, with an hour long dawn and dusk
+    daytime = np.clip((np.sin(2 * np.pi * (hours % 24 - 6) / 24) + 0.25) * 2, 0, 1)
+    moonlight = (1 - np.cos(2 * np.pi * hours / (29.53 * 24))) / 2
+    base_depths = 40 + 30 * moonlight + (300 - 30 * moonlight) * daytime
+
+    # dives ~20 min long whose size changes every hour
+    rng = np.random.default_rng(seed)
+    dive_sizes = rng.gamma(2, 15, int(hours[-1]) + 2 if num_rows else 1)[hours.astype(np.int64)]
+    dives = dive_sizes * np.sin(2 * np.pi * hours * 3 + rng.uniform(0, 2 * np.pi))
+    depths = np.round(np.clip(base_depths + dives + rng.normal(0, 2, num_rows), 0, None) * 2) / 2
+    temps = np.round(8 + 17 / (1 + np.exp((depths - 120) / 40)) + rng.normal(0, 0.1, num_rows), 2)
+
+    # wall clock time of the tag's timezone
+    times = times.tz_convert(tag_format.timezone).tz_localize(None)
+    columns = {
+        "Date": times.strftime("%m/%d/%Y"),
+        "Time": times.strftime("%H:%M:%S"),
+        "Year": times.year,
+        "Month": times.month,
+        "Day": times.day,
+        "Hour": times.hour,
+        "Min": times.minute,
+        "Sec": times.second,
+        "Depth(m)": depths,
+        "ExtTemp(C)": temps,
+        }
+    return pd.DataFrame({tag_format.get_file_column(col): values for col, values in columns.items()})
+
+
+def make_synthetic_positions(datetimes, shark_id, seed=0, missing_days=2):
+    """
+    Given a Series of tz-aware datetimes of one shark, its ID,
+    a random seed and a number of days at the end without
+    fixes, returns a dataframe like
+    geolocation.load_ssm_positions of one fix per day at
+    noon, wandering about 0.1 degrees a day around Oahu.
+    """
+    days = pd.date_range(datetimes.min().normalize(), datetimes.max().normalize(), freq="D")
+    days = days[:max(len(days) - missing_days, 1)]
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.1, (len(days), 2)).cumsum(axis=0)
+    return pd.DataFrame({
+        "Id": shark_id,
+        "Fix Datetime": days + pd.Timedelta(hours=12),
+        "Latitude": 21.3 + steps[:, 0],
+        "Longitude": -157.9 + steps[:, 1],
+        })
+
+
+# benchmarks ##############################################
+def bench_standardized_datetime(num_rows, num_rowwise_rows=100000):
+    """
+    Given a number of rows, times the columnar timezone
+    standardization against the row-wise one (timed on the
+    first num_rowwise_rows rows and scaled up), checks that
+    both give the same values, and prints the results.
+    """
+    df = make_synthetic_tag_data(num_rows)
+    originaltz = figures.getOriginalTimezone(df.columns[0])
+
+    start = time.perf_counter()
+    vectorized = figures.getStandardizedDatetimes(df, originaltz)
+    vectorized_sec = time.perf_counter() - start
+
+    head = df.head(num_rowwise_rows)
+    start = time.perf_counter()
+    rowwise = head.apply(lambda row: figures.getStandardizedDatetime(row, originaltz), axis=1)
+    rowwise_sec = (time.perf_counter() - start) * num_rows / len(head)
+
+    assert (pd.to_datetime(rowwise) == vectorized.head(num_rowwise_rows)).all()
+
+    print('Timezone standardization for', num_rows, 'rows',
+    '\n', 'row-wise (estimated): ', round(rowwise_sec, 2), 's',
+    '\n', 'vectorized: ', round(vectorized_sec, 2), 's',
+    '\n', 'speedup: ', round(rowwise_sec / vectorized_sec, 1), 'x')
+
+
+def bench_parallel_ingest(num_files, rows_per_file, worker_counts=(1, 2, 4, 8)):
+    """
+    Given a number of synthetic tag files and rows per file,
+    times cleaning.ingest_tag_dir_parallel with each number
+    of worker processes and prints the results.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shark_ids = [str(1900000 + i * 100) for i in range(num_files)]
+        for shark_id in shark_ids:
+            df = make_synthetic_tag_data(rows_per_file)
+            df.to_csv(join(tmp_dir, shark_id + '_00P0000_corrected.csv'), index=False)
+
+        meta_df = pd.DataFrame({
+            'eventid': [int(shark_id + '00') for shark_id in shark_ids],
+            'sex': ['F'] * num_files,
+            'length': [450] * num_files,
+            'Sampling Period (sec)': [10] * num_files,
+            })
+
+        print('Parallel ingest of', num_files, 'files x', rows_per_file, 'rows')
+        base_sec = None
+        for num_workers in worker_counts:
+            start = time.perf_counter()
+            cleaning.ingest_tag_dir_parallel(tmp_dir, meta_df, 20.5, -157.0,
+                                             join(tmp_dir, 'master'), num_workers)
+            elapsed_sec = time.perf_counter() - start
+            base_sec = base_sec or elapsed_sec
+            print('', num_workers, 'workers: ', round(elapsed_sec, 2), 's',
+                  '(speedup ', round(base_sec / elapsed_sec, 1), 'x)')
+
+
+def time_pipeline_stages(filename, sample_period_sec, shark_id="1900004"):
+    """
+    Given a filename of a tag file, its sampling period in
+    seconds and a shark ID, runs the processing and plotting
+    stages on it in order and returns a dict of stage name to
+    seconds taken.
+    """
+    seconds = {}
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds[stage] = time.perf_counter() - start
+        return result
+
+    tag_format, df = timed("parse", tag_formats.read_tag_file, filename)
+
+    def standardize(df):
+        df["Datetime (UTC-10)"] = figures.getStandardizedDatetimes(df, tag_format.timezone)
+        df["Hour (UTC-10)"] = df["Datetime (UTC-10)"].dt.hour
+        return df
+
+    def label(df):
+        df["Time of Day"] = get_times_of_day(df["Hour (UTC-10)"])
+        return df
+
+    def label_astral(df):
+        # sun events are cached across calls, so each run
+        # starts cold like a new session
+        time_of_day._get_sun_events.cache_clear()
+        df["Time of Day (Astral)"] = get_times_of_day_astral(df["Datetime (UTC-10)"], df["Latitude"],
+                                                             df["Longitude"], default_lat=21.3, default_lon=-157.9)
+        return df
+
+    df = timed("timezone", standardize, df)
+    df = timed("time_of_day", label, df)
+    df["Id"] = shark_id
+    positions = make_synthetic_positions(df["Datetime (UTC-10)"], shark_id)
+    df = timed("positions", add_positions, df, positions, True)
+    df = timed("time_of_day_astral", label_astral, df)
+    df = timed("moon_phase", add_moon_phase, df)
+
+    df["External Temp (c)"] = df["ExtTemp(C)"]
+    df = timed("velocity", cleaning.add_grouped_velocities, df, {shark_id: sample_period_sec})
+    df = timed("hourly_aggregation", aggregation.add_hourly_metrics, df)
+
+    plt.switch_backend("Agg")
+    plt.figure()
+    timed("heatmap", figures.plotHeatMap, df, shark_id)
+    plt.close("all")
+    timed("violin", figures.plotDepthTimeViolin, df, 28, shark_id)
+    plt.close("all")
+    return seconds
+
+
+def bench_stages(base_rows, sample_period_sec=10, tag_format="UTC", scales=STAGE_SCALES, repeats=3):
+    """
+    Given a base number of rows, a sampling period in seconds,
+    a tag format name, the multiples of base_rows to run and
+    the number of runs per size, times every pipeline stage
+    on a synthetic tag file of each size and returns a list
+    of dicts with the stage, scale, rows, sampling period,
+    tag format, seconds (the fastest run) and rows per
+    second.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in scales:
+            num_rows = base_rows * scale
+            filename = join(tmp_dir, "1900004_00P0000_corrected.csv")
+            make_synthetic_tag_data(num_rows, sample_period_sec, tag_format).to_csv(filename, index=False)
+
+            runs = [time_pipeline_stages(filename, sample_period_sec) for _ in range(repeats)]
+            for stage in runs[0]:
+                seconds = min(run[stage] for run in runs)
+                results.append({
+                    "stage": stage,
+                    "scale": scale,
+                    "rows": num_rows,
+                    "sample_period_sec": sample_period_sec,
+                    "tag_format": tag_format,
+                    "seconds": seconds,
+                    "rows_per_sec": num_rows / seconds if seconds > 0 else float("inf"),
+                    })
+    return results
+
+
+def save_results(results, path):
+    """
+    Given a list of benchmark result dicts and a path, writes
+    them as JSON with the versions and machine they were run
+    on.
+    """
+    with open(path, "w") as f:
+        json.dump({
+            "created": pd.Timestamp.now(tz="UTC").isoformat(),
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "results": results,
+            }, f, indent=1)
+
+
+def compare_to_baseline(results, path, tolerance=REGRESSION_TOLERANCE):
+    """
+    Given a list of benchmark result dicts, the path of a
+    baseline written by save_results and the slowdown allowed,
+    returns a pandas dataframe with the baseline and current
+    rows per second of every stage and scale in both, their
+    ratio and whether the stage regressed.
+    """
+    with open(path) as f:
+        baseline = pd.DataFrame(json.load(f)["results"])
+    keys = ["stage", "scale", "sample_period_sec", "tag_format"]
+    comparison = pd.DataFrame(results).merge(baseline, on=keys, suffixes=("", "_baseline"))
+    comparison["slowdown"] = comparison["rows_per_sec_baseline"] / comparison["rows_per_sec"]
+    comparison["regression"] = comparison["slowdown"] > tolerance
+    return comparison[keys + ["rows", "rows_per_sec_baseline", "rows_per_sec", "slowdown", "regression"]]
+
+
+def print_stage_results(results):
+    """
+    Given a list of benchmark result dicts, prints the
+    seconds of each stage at each number of rows.
+    """
+    table = pd.DataFrame(results).pivot(index="stage", columns="rows", values="seconds")
+    table = table.loc[pd.unique(pd.DataFrame(results)["stage"])]
+    print('Seconds per stage by number of rows')
+    print(table.round(3).to_string())
+
+
+if __name__ == "__main__":
+
+    bench = sys.argv[1] if len(sys.argv) > 1 else 'datetime'
+
+    if bench == 'datetime':
+        num_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 5000000
+        bench_standardized_datetime(num_rows)
+    elif bench == 'ingest':
+        num_files = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+        rows_per_file = int(sys.argv[3]) if len(sys.argv) > 3 else 500000
+        bench_parallel_ingest(num_files, rows_per_file)
+    elif bench in ('stages', 'baseline'):
+        base_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        sample_period_sec = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        tag_format = sys.argv[4] if len(sys.argv) > 4 else 'UTC'
+        results = bench_stages(base_rows, sample_period_sec, tag_format)
+        print_stage_results(results)
+
+        if bench == 'baseline':
+            save_results(results, BASELINE_PATH)
+        else:
+            save_results(results, RESULTS_PATH)
+            if exists(BASELINE_PATH):
+                comparison = compare_to_baseline(results, BASELINE_PATH)
+                print(comparison.round(2).to_string(index=False))
+                print(int(comparison['regression'].sum()), 'regressions')
+    else:
+        raise ValueError("Unknown benchmark " + bench)
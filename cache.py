@@ -0,0 +1,223 @@
+import hashlib
+import importlib
+from importlib import metadata
+import json
+import os
+from os.path import exists, getsize, join
+import pickle
+import time
+
+import pandas as pd
+
+from instrumentation import stage
+
+
+# On-disk cache of White Shark Pa'ina pipeline stage results,
+# so re-running the cleaning notebook only recomputes what
+# changed. A stage result is keyed by the sha256 of the
+# stage name, its inputs (file contents, not paths or
+# mtimes; or the key of the stage it was computed from),
+# its parameters and the source of the modules it runs and
+# the versions of the libraries they use (code version).
+# Dataframes are stored as Parquet, other
+# results pickled. Each hit marks its file as recently used,
+# and the least recently used results are deleted once the
+# cache holds more than max_bytes.
+
+CACHE_DIR = ".stage_cache"
+
+MAX_CACHE_BYTES = 4 << 30
+
+# libraries whose versions are part of every code version
+LIBRARIES = ["astral", "numpy", "pandas", "pyarrow"]
+
+# age after which a temporary file is a leftover of a crashed
+# write rather than another process's write in progress
+TMP_GRACE_SECONDS = 60 * 60
+
+# file hashes by (path, size, mtime), so an unchanged tag
+# file is read once per session
+_file_hashes = {}
+
+
+def get_file_hash(filename, block_size=1 << 20):
+    """
+    Given a filename, returns the hex sha256 of its contents,
+    read block_size bytes at a time.
+    """
+    info = os.stat(filename)
+    stat_key = (os.path.abspath(filename), info.st_size, info.st_mtime_ns)
+    if stat_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        _file_hashes[stat_key] = digest.hexdigest()
+    return _file_hashes[stat_key]
+
+
+def get_code_version(*modules):
+    """
+    Given module names (e.g. "cleaning"), returns the hex
+    sha256 of their source files and the LIBRARIES versions,
+    so results are recomputed after the code that made them
+    or a library it uses changes.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(modules):
+        digest.update(name.encode())
+        digest.update(get_file_hash(importlib.import_module(name).__file__).encode())
+    for library in LIBRARIES:
+        try:
+            version = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            version = None
+        digest.update("{}=={}".format(library, version).encode())
+    return digest.hexdigest()
+
+
+def get_key(stage_name, *parts):
+    """
+    Given a stage name and any JSON-able inputs, parameters
+    and versions (dataframes by their contents), returns the
+    hex sha256 key of the stage result.
+    """
+    def default(value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return pd.util.hash_pandas_object(value).to_numpy().tobytes().hex()
+        return str(value)
+    text = json.dumps([stage_name, parts], sort_keys=True, default=default)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class StageCache(object):
+    """
+    A directory of stage results, one file per key, holding
+    at most max_bytes (least recently used results are
+    deleted first). A path of None disables caching: every
+    stage is computed and nothing is written.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def _get_paths(self, key):
+        return join(self.path, key + ".parquet"), join(self.path, key + ".pickle")
+
+    def load(self, key):
+        """
+        Given a key, returns (True, result) if it is cached,
+        else (False, None).
+        """
+        if self.path is None:
+            return False, None
+        parquet_path, pickle_path = self._get_paths(key)
+        for path in (parquet_path, pickle_path):
+            if exists(path):
+                try:
+                    if path == parquet_path:
+                        result = pd.read_parquet(path, engine="pyarrow")
+                    else:
+                        with open(path, "rb") as f:
+                            result = pickle.load(f)
+                    # mark as recently used for eviction
+                    os.utime(path)
+                except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+                    # evicted (or replaced) while reading or
+                    # marking, or a partial file: a miss
+                    return False, None
+                return True, result
+        return False, None
+
+    def save(self, key, result):
+        """
+        Given a key and a stage result, writes it to the cache
+        and evicts the least recently used results if the
+        cache is over max_bytes.
+        """
+        if self.path is None:
+            return
+        parquet_path, pickle_path = self._get_paths(key)
+        path = parquet_path if isinstance(result, pd.DataFrame) else pickle_path
+
+        # write then rename so an interrupted run (or another
+        # process) never reads a partial result
+        tmp_path = path + ".{}.tmp".format(os.getpid())
+        if isinstance(result, pd.DataFrame):
+            result.to_parquet(tmp_path, engine="pyarrow")
+        else:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_size(self):
+        """
+        Returns the number of bytes of results in the cache.
+        """
+        if self.path is None:
+            return 0
+        return sum(getsize(join(self.path, name)) for name in os.listdir(self.path))
+
+    def evict(self, max_bytes=None):
+        """
+        Given a number of bytes (None for max_bytes), deletes
+        the least recently used results until the cache holds
+        at most that many. Returns the number deleted.
+        Temporary files younger than TMP_GRACE_SECONDS are
+        writes in progress and never deleted.
+        """
+        if self.path is None:
+            return 0
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        grace_start_ns = time.time_ns() - TMP_GRACE_SECONDS * 10 ** 9
+        entries = []
+        for name in os.listdir(self.path):
+            try:
+                info = os.stat(join(self.path, name))
+            except FileNotFoundError:
+                continue
+            if name.endswith(".tmp") and info.st_mtime_ns > grace_start_ns:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        num_deleted = 0
+        for _, size, name in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            num_deleted += 1
+        return num_deleted
+
+    def clear(self):
+        """
+        Deletes every result in the cache.
+        """
+        self.evict(0)
+
+    def get_or_compute(self, key, compute, *args, **kwargs):
+        """
+        Given a key and a function, returns the cached result
+        of the key, or calls compute with the other arguments
+        and caches its result.
+        """
+        with stage("cache_load"):
+            found, result = self.load(key)
+        if found:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = compute(*args, **kwargs)
+        with stage("cache_save"):
+            self.save(key, result)
+        return result
@@ -0,0 +1,423 @@
+from multiprocessing import Pool
+from os import listdir
+from os.path import getsize, isfile, join
+import numpy as np
+import pandas as pd
+import re
+
+from aggregation import add_daily_sst, add_hourly_metrics
+from cache import StageCache, get_code_version, get_file_hash, get_key
+from dives import BOTTOM_FRACTION, DIVE_THRESHOLD, MIN_DIVE_DURATION, add_hourly_dive_frequency, get_dives
+import figures
+from geolocation import add_positions, load_ssm_positions
+from instrumentation import add_records, clear_records, get_records, instrument, stage
+from lunar import add_moon_phase
+from schema import apply_schema
+from storage import write_master_dataset
+from tag_formats import get_tag_format, iter_tag_file, read_header
+from time_of_day import SUN_CELL_SIZE, get_times_of_day, get_times_of_day_astral
+
+
+# Processing steps from data_cleaning.ipynb for building the
+# White Shark Pa'ina master dataset from corrected archival
+# tag files, written so they can run on one block of rows
+# at a time.
+
+# rows read from a tag file at once in chunked mode
+CHUNK_SIZE = 1000000
+
+BASE_COLUMNS = ["Id", "Datetime (UTC-10)", "Hour (UTC-10)", "Time of Day", "Time of Day (Astral)",
+                "Depth(m)", "External Temp (c)", "Sex", "Shark Length (cm)", "Moon Phase",
+                "Moon Phase (days)", "Moon Illumination"]
+
+VELOCITY_COLUMNS = ["Depth Diff (m)", "Vertical Velocity (m/s)", "Speed (m/s)"]
+
+COLUMNS = BASE_COLUMNS + VELOCITY_COLUMNS
+
+# columns of read_shark_tag_file
+TAG_FILE_COLUMNS = ["Id", "Datetime (UTC-10)", "Hour (UTC-10)", "Time of Day", "Depth(m)", "External Temp (c)",
+                    "Sex", "Shark Length (cm)"]
+
+# modules whose code read_shark_tag_file runs, for its cache
+# key
+TAG_FILE_MODULES = ["cleaning", "figures", "schema", "tag_formats", "time_of_day"]
+
+
+def get_filepaths_in_dir(dir_path):
+    """
+    Given a directory path, return a list of files in the given directory.
+    >>> get_files_in_dir('./test')
+    ['test1.txt', 'test.txt']
+    """
+    only_files = [join(dir_path, f) for f in listdir(dir_path) if isfile(join(dir_path, f))]
+    return only_files
+
+
+def filter_csvs(filepaths):
+    """
+    Given a list of filepaths, returns a list containing only the csv filepaths
+    in the given list.
+    """
+    csv_files = [f for f in filepaths if '.csv' in f]
+    return csv_files
+
+
+def get_shark_ID(filepath):
+    """
+    Given string filepath, returns 7 digit shark ID in filepath
+    name.
+    """
+    # pattern matches any sequence of 7 digits
+    pattern = '\\d{7}'
+
+    sharkIDMatch = re.search(pattern, filepath)
+    assert sharkIDMatch, 'Could not find 7 digit ID in filepath: {}'.format(filepath)
+
+    sharkID = sharkIDMatch.group(0)
+    return sharkID + '00'
+
+
+def get_shark_meta_data(meta_df, shark_id):
+    """
+    Given the meta data dataframe and a shark ID, returns a
+    dict of the shark's sex, length (cm) and PSAT sampling
+    period (sec).
+    """
+    row = meta_df[meta_df['eventid'].astype(str) == str(shark_id)].iloc[0]
+    return {
+        'Sex': row['sex'],
+        'Shark Length (cm)': row['length'],
+        'Sampling Period (sec)': row['Sampling Period (sec)'],
+        }
+
+
+@instrument()
+def process_tag_chunk(df, originaltz, shark_id, shark_meta, lat, lon):
+    """
+    Given a block of rows from a corrected archival tag file,
+    the timezone of its timestamps, the shark's ID and meta
+    data, and a latitude and longitude for sun times, returns
+    a dataframe with the master dataset columns other than
+    the velocities.
+    """
+    df = df.copy()
+    df["Datetime (UTC-10)"] = figures.getStandardizedDatetimes(df, originaltz)
+    df["Hour (UTC-10)"] = df["Datetime (UTC-10)"].dt.hour
+    with stage("get_times_of_day", rows=len(df)):
+        df["Time of Day"] = get_times_of_day(df["Hour (UTC-10)"])
+    df["Time of Day (Astral)"] = get_times_of_day_astral(df["Datetime (UTC-10)"], lat, lon)
+    df = add_moon_phase(df)
+
+    df['Id'] = shark_id
+    df['Sex'] = shark_meta['Sex']
+    df['Shark Length (cm)'] = shark_meta['Shark Length (cm)']
+    df['External Temp (c)'] = df['ExtTemp(C)']
+    return df
+
+
+@instrument()
+def add_velocities(df, sample_period):
+    """
+    Given a dataframe of one shark's rows in time order and
+    its PSAT sampling period (sec), adds depth difference to
+    the next row, vertical velocity (m/s) and speed (m/s)
+    columns. Negative values mean descending in depth and
+    positive means ascending. The last row has no next row
+    and gets NaN.
+    """
+    df["Depth Diff (m)"] = df['Depth(m)'].diff(periods=-1)
+    df['Vertical Velocity (m/s)'] = df["Depth Diff (m)"] / sample_period
+    df['Speed (m/s)'] = df['Vertical Velocity (m/s)'].abs()
+    return df
+
+
+def get_sample_periods(meta_df):
+    """
+    Given the meta data dataframe, returns a dict of shark ID
+    (str) to PSAT sampling period (sec).
+    """
+    return dict(zip(meta_df['eventid'].astype(str), meta_df['Sampling Period (sec)']))
+
+
+@instrument()
+def add_grouped_velocities(df, sample_periods=None, max_gap_sec=None):
+    """
+    Given a dataframe of one or more sharks' rows, with each
+    shark's rows together and in time order, adds depth
+    difference to the next row, vertical velocity (m/s) and
+    speed (m/s) columns for all sharks at once. Velocity uses
+    the dict of shark ID to sampling period (sec) if given,
+    else the actual time to the next sample. Rows more than
+    max_gap_sec from the next sample get NaN velocities, as
+    does each shark's last row.
+    """
+    codes, shark_ids = pd.factorize(df['Id'])
+
+    # next row belongs to the same shark
+    has_next = np.zeros(len(df), dtype=bool)
+    has_next[:-1] = codes[:-1] == codes[1:]
+
+    depths = df['Depth(m)'].to_numpy(dtype=float)
+    depth_diff = np.full(len(df), np.nan)
+    depth_diff[:-1] = depths[:-1] - depths[1:]
+    depth_diff[~has_next] = np.nan
+
+    times = df['Datetime (UTC-10)'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy()
+    gap_sec = np.full(len(df), np.nan)
+    gap_sec[:-1] = (times[1:] - times[:-1]) / np.timedelta64(1, 's')
+
+    if sample_periods is None:
+        periods = gap_sec
+    else:
+        shark_periods = np.array([sample_periods.get(str(Id), np.nan) for Id in shark_ids], dtype=float)
+        periods = shark_periods[codes]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = depth_diff / periods
+    velocity[~(periods > 0)] = np.nan
+    if max_gap_sec is not None:
+        velocity[gap_sec > max_gap_sec] = np.nan
+
+    df["Depth Diff (m)"] = depth_diff
+    df['Vertical Velocity (m/s)'] = velocity
+    df['Speed (m/s)'] = np.abs(velocity)
+    return df
+
+
+def iter_tag_file_chunks(filename, meta_df, lat, lon, chunk_size=CHUNK_SIZE):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, the meta data dataframe, a latitude and longitude
+    for sun times and a number of rows, yields processed
+    dataframes of at most chunk_size rows (the first may hold
+    one less) in time order. Only one block of the file is in
+    memory at a time.
+    """
+    shark_id = get_shark_ID(filename)
+    shark_meta = get_shark_meta_data(meta_df, shark_id)
+    tag_format = get_tag_format(read_header(filename))
+
+    # the last row of each block needs the first row of the
+    # next block for its depth diff, so it is held back
+    held_back = None
+    for chunk in iter_tag_file(filename, chunk_size, tag_format=tag_format):
+        df = process_tag_chunk(chunk, tag_format.timezone, shark_id, shark_meta, lat, lon)[BASE_COLUMNS]
+        if held_back is not None:
+            df = pd.concat([held_back, df], ignore_index=True)
+
+        df = add_velocities(df, shark_meta['Sampling Period (sec)'])
+        held_back = df.iloc[-1:][BASE_COLUMNS]
+        if len(df) > 1:
+            yield apply_schema(df.iloc[:-1][COLUMNS])
+
+    if held_back is not None:
+        yield apply_schema(add_velocities(held_back.copy(), shark_meta['Sampling Period (sec)'])[COLUMNS])
+
+
+def ingest_tag_file_chunked(filename, meta_df, lat, lon, out_path, chunk_size=CHUNK_SIZE):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, the meta data dataframe, a latitude and longitude
+    for sun times, the directory path of the master dataset
+    and a number of rows, processes the file chunk_size rows
+    at a time and writes each block to the shark's partition
+    of the master dataset. Returns a dict with the shark ID,
+    the number of rows written and the max depth recorded.
+    """
+    num_rows = 0
+    max_depth = np.nan
+    with stage("ingest_tag_file", get_shark_ID(filename)) as record:
+        for part, df in enumerate(iter_tag_file_chunks(filename, meta_df, lat, lon, chunk_size)):
+            write_master_dataset(df, out_path, append=part > 0, part=part)
+            num_rows += len(df)
+            max_depth = np.fmax(max_depth, df['Depth(m)'].max())
+        record['Rows'] = num_rows
+
+    return {
+        'eventid': get_shark_ID(filename),
+        'Rows': num_rows,
+        'Max Depth Recorded (m)': max_depth,
+        }
+
+
+def read_shark_tag_file(filename, meta_df):
+    """
+    Given a filename to corrected archival White Shark tag
+    data and the meta data dataframe, returns the file's rows
+    with standardized datetimes, hour and time of day
+    (figures.getPlotData) and the shark's Id, sex, length and
+    external temperature columns, like each file's frame in
+    data_cleaning.ipynb.
+    """
+    shark_id = get_shark_ID(filename)
+    shark_meta = get_shark_meta_data(meta_df, shark_id)
+    df = figures.getPlotData(filename)
+    df['Id'] = shark_id
+    df['Sex'] = shark_meta['Sex']
+    df['External Temp (c)'] = df['ExtTemp(C)']
+    df['Shark Length (cm)'] = shark_meta['Shark Length (cm)']
+    return apply_schema(df[TAG_FILE_COLUMNS])
+
+
+def add_times_of_day_astral(df, positions, cell_size=SUN_CELL_SIZE):
+    """
+    Given a dataframe with "Latitude" and "Longitude" columns
+    from geolocation.add_positions, the SSM positions and the
+    sun event grid cell size, adds a "Time of Day (Astral)"
+    column. Rows without a position use the mean SSM position.
+    """
+    df["Time of Day (Astral)"] = get_times_of_day_astral(df["Datetime (UTC-10)"], df["Latitude"], df["Longitude"],
+                                                         cell_size, positions["Latitude"].mean(),
+                                                         positions["Longitude"].mean())
+    return df
+
+
+def add_dive_frequency(df, threshold=DIVE_THRESHOLD, bottom_fraction=BOTTOM_FRACTION, end_threshold=None,
+                       min_duration=MIN_DIVE_DURATION):
+    """
+    Given a dataframe of one or more sharks' rows and the
+    get_dives parameters (start and end depths, bottom phase
+    fraction and shortest dive), adds the hourly dive
+    frequency of get_dives' dives.
+    """
+    return add_hourly_dive_frequency(df, get_dives(df, threshold, bottom_fraction, end_threshold, min_duration))
+
+
+# stages run on each shark's rows from read_shark_tag_file,
+# in the order of data_cleaning.ipynb: name, function of the
+# rows, parameters, run inputs passed to it by keyword (see
+# get_cleaned_sharks) and the modules whose code it runs
+SHARK_STAGES = [
+    ("positions", add_positions, {"interpolate": True}, ["positions"], ["geolocation"]),
+    ("time_of_day_astral", add_times_of_day_astral, {"cell_size": SUN_CELL_SIZE}, ["positions"],
+     ["cleaning", "time_of_day"]),
+    ("velocities", add_grouped_velocities, {}, ["sample_periods"], ["cleaning"]),
+    ("moon_phase", add_moon_phase, {}, [], ["lunar"]),
+    ("dive_frequency", add_dive_frequency,
+     {"threshold": DIVE_THRESHOLD, "bottom_fraction": BOTTOM_FRACTION, "end_threshold": None,
+      "min_duration": MIN_DIVE_DURATION}, [], ["cleaning", "dives", "aggregation"]),
+    ("hourly_metrics", add_hourly_metrics, {}, [], ["aggregation"]),
+    ("daily_sst", add_daily_sst, {"max_depth": 5}, [], ["aggregation"]),
+    ]
+
+
+def get_cleaned_shark(filename, meta_df, cache, inputs, input_hashes, stages=SHARK_STAGES):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, the meta data dataframe, a StageCache, a dict of
+    run inputs the stages take (e.g. "positions"), a dict of
+    the content hashes of those inputs that aren't per shark
+    meta data and a list of stages like SHARK_STAGES, returns
+    the shark's rows after every stage. Each stage's result
+    is cached under a key of the key it was computed from,
+    its parameters, the hashes of its inputs and its code
+    version; the first is keyed by the tag file's contents
+    and the shark's own meta data. Only the latest cached
+    stage is loaded and the stages after it are computed.
+    """
+    shark_id = get_shark_ID(filename)
+    keys = [get_key("tag_file", get_file_hash(filename), get_shark_meta_data(meta_df, shark_id),
+                    get_code_version(*TAG_FILE_MODULES))]
+    for name, _, params, input_names, modules in stages:
+        keys.append(get_key(name, keys[-1], params, [input_hashes.get(input_name) for input_name in input_names],
+                            get_code_version(*modules)))
+
+    def get_stage(i):
+        # stage i's result, from the cache or from stage i - 1
+        if i == 0:
+            return cache.get_or_compute(keys[0], read_shark_tag_file, filename, meta_df)
+        _, func, params, input_names, _ = stages[i - 1]
+        kwargs = dict(params, **{input_name: inputs[input_name] for input_name in input_names})
+        return cache.get_or_compute(keys[i], lambda: func(get_stage(i - 1), **kwargs))
+
+    with stage("get_cleaned_shark", shark_id):
+        return get_stage(len(keys) - 1)
+
+
+def get_cleaned_sharks(files, meta_df, ssm_path, cache=None, stages=SHARK_STAGES):
+    """
+    Given a list of corrected archival White Shark tag files,
+    the meta data dataframe, the path of the SSM positions
+    csv, a StageCache (None to compute everything) and a list
+    of stages, returns get_cleaned_shark of every file in one
+    dataframe with the schema's types: the combined frame of
+    data_cleaning.ipynb. Re-running it only recomputes sharks
+    whose tag file or meta data changed, stages whose code or
+    parameters changed and, if the SSM file changed, the
+    stages from positions on.
+    """
+    cache = cache if cache is not None else StageCache(None)
+    inputs = {
+        "positions": load_ssm_positions(ssm_path),
+        # per shark, so covered by the shark's meta data key
+        "sample_periods": get_sample_periods(meta_df),
+        }
+    input_hashes = {"positions": get_file_hash(ssm_path)}
+    dfs = [get_cleaned_shark(file, meta_df, cache, inputs, input_hashes, stages) for file in sorted(files)]
+    return apply_schema(pd.concat(dfs, ignore_index=True))
+
+
+def merge_ingest_summaries(meta_df, summaries):
+    """
+    Given the meta data dataframe and a list of dicts
+    returned by ingest_tag_file_chunked, returns a copy of
+    the meta data with the rows written and max depth
+    recorded for each shark.
+    """
+    meta_df = meta_df.copy()
+    meta_df['eventid'] = meta_df['eventid'].astype(str)
+    summary_df = pd.DataFrame(summaries, columns=['eventid', 'Rows', 'Max Depth Recorded (m)'])
+    meta_df = meta_df.drop(columns=['Rows', 'Max Depth Recorded (m)'], errors='ignore')
+    return meta_df.merge(summary_df, how='left', on='eventid')
+
+
+def ingest_tag_dir_chunked(dir_path, meta_df, lat, lon, out_path, chunk_size=CHUNK_SIZE):
+    """
+    Given a directory of corrected archival White Shark tag
+    files, the meta data dataframe, a latitude and longitude
+    for sun times, the directory path of the master dataset
+    and a number of rows, runs ingest_tag_file_chunked on
+    each file one after the other. Returns the meta data
+    merged with each shark's ingest summary.
+    """
+    files = filter_csvs(get_filepaths_in_dir(dir_path))
+    summaries = [ingest_tag_file_chunked(file, meta_df, lat, lon, out_path, chunk_size)
+                 for file in sorted(files)]
+    return merge_ingest_summaries(meta_df, summaries)
+
+
+def _ingest_tag_file_star(args):
+    # the worker's stage records go back with its summary
+    # (forked workers start with a copy of the parent's)
+    clear_records()
+    summary = ingest_tag_file_chunked(*args)
+    return summary, get_records()
+
+
+def ingest_tag_dir_parallel(dir_path, meta_df, lat, lon, out_path, num_workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Given a directory of corrected archival White Shark tag
+    files, the meta data dataframe, a latitude and longitude
+    for sun times, the directory path of the master dataset,
+    a number of worker processes (default: one per core) and
+    a number of rows, runs ingest_tag_file_chunked on the
+    files in a process pool. Each worker writes its own
+    shark's partition and gets only that shark's meta data.
+    Returns the meta data merged with each shark's ingest
+    summary.
+    """
+    files = sorted(filter_csvs(get_filepaths_in_dir(dir_path)))
+    meta_ids = meta_df['eventid'].astype(str)
+    tasks = [(file, meta_df[meta_ids == get_shark_ID(file)], lat, lon, out_path, chunk_size)
+             for file in files]
+
+    # largest files first so one big tag doesn't start last
+    tasks.sort(key=lambda task: getsize(task[0]), reverse=True)
+    with Pool(num_workers) as pool:
+        results = pool.map(_ingest_tag_file_star, tasks, chunksize=1)
+
+    summaries = []
+    for summary, records in results:
+        summaries.append(summary)
+        add_records(records)
+    return merge_ingest_summaries(meta_df, summaries)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from lunar import MOON_PHASES
+from time_of_day import TIMES_OF_DAY
+
+
+# Counts of White Shark Pa'ina tag samples by shark, hour,
+# depth bin, time of day and moon phase, built once with
+# np.bincount so heatmaps and subset comparisons can slice
+# the counts instead of rescanning every sample.
+
+HOURS = list(range(24))
+
+
+def _getCodes(values, categories):
+    # index into categories, with missing/unknown labels in
+    # the extra last slot
+    valueCodes, uniques = pd.factorize(values)
+    lookup = np.array([categories.index(u) if u in categories else len(categories) for u in uniques] +
+                      [len(categories)], dtype=np.int64)
+    return lookup[valueCodes]
+
+
+class DepthHistogramCube(object):
+    """
+    Sample counts with dimensions shark x hour (UTC-10) x
+    depth bin x time of day x moon phase. Depth bins are
+    binSize meters wide up to maxDepth and closed on the
+    right like pd.cut, so a depth of exactly 0 m or deeper
+    than the last bin is not counted. Call add() with each
+    dataframe (or chunk) of tag data.
+    """
+
+    def __init__(self, binSize=10, maxDepth=700, timeOfDayCol="Time of Day (Astral)"):
+        self.binEdges = np.arange(0, maxDepth, binSize)
+        self.depthBins = self.binEdges[:-1]
+        self.timeOfDayCol = timeOfDayCol
+        self.ids = []
+        self.counts = np.zeros((0, len(HOURS), len(self.depthBins), len(TIMES_OF_DAY) + 1, len(MOON_PHASES) + 1),
+                               dtype=np.int64)
+
+    def add(self, df, Id=None):
+        """
+        Given a pandas dataframe of tag data with "Hour
+        (UTC-10)" and "Depth(m)" columns, and optionally time
+        of day and "Moon Phase" columns, adds its samples to
+        the counts. Samples are counted under the df's "Id"
+        column, or under Id if df has no "Id" column.
+        """
+        if "Id" in df.columns:
+            sharkIds = df["Id"].astype(str).to_numpy()
+        else:
+            sharkIds = np.full(len(df), str(Id), dtype=object)
+        
+        idCodes = _getCodes(sharkIds, self.ids)
+        newIds = pd.unique(sharkIds[idCodes == len(self.ids)])
+        if len(newIds):
+            self.ids = self.ids + list(newIds)
+            grown = np.zeros((len(self.ids),) + self.counts.shape[1:], dtype=np.int64)
+            grown[:self.counts.shape[0]] = self.counts
+            self.counts = grown
+            idCodes = _getCodes(sharkIds, self.ids)
+
+        hours = df["Hour (UTC-10)"].to_numpy(dtype=np.int64)
+
+        # same bins as pd.cut(depths, bins=binEdges)
+        binCodes = np.searchsorted(self.binEdges, df["Depth(m)"].to_numpy(dtype=float), side="left") - 1
+
+        if self.timeOfDayCol in df.columns:
+            timeOfDayCodes = _getCodes(df[self.timeOfDayCol], TIMES_OF_DAY)
+        else:
+            timeOfDayCodes = np.full(len(df), len(TIMES_OF_DAY))
+        if "Moon Phase" in df.columns:
+            moonCodes = _getCodes(df["Moon Phase"], MOON_PHASES)
+        else:
+            moonCodes = np.full(len(df), len(MOON_PHASES))
+
+        inCube = (binCodes >= 0) & (binCodes < len(self.depthBins)) & (hours >= 0) & (hours < len(HOURS))
+        flatIndex = np.ravel_multi_index(
+            (idCodes[inCube], hours[inCube], binCodes[inCube], timeOfDayCodes[inCube], moonCodes[inCube]),
+            self.counts.shape)
+        self.counts += np.bincount(flatIndex, minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def select(self, ids=None, timesOfDay=None, moonPhases=None):
+        """
+        Given lists of shark ids, times of day and moon phases
+        (None for all), returns the depth bin x hour array of
+        counts summed over the selection.
+        """
+        counts = self.counts
+        if ids is not None:
+            counts = counts[[self.ids.index(str(Id)) for Id in ids]]
+        if timesOfDay is not None:
+            counts = counts[:, :, :, [TIMES_OF_DAY.index(t) for t in timesOfDay]]
+        if moonPhases is not None:
+            counts = counts[:, :, :, :, [MOON_PHASES.index(m) for m in moonPhases]]
+        return counts.sum(axis=(0, 3, 4)).T
+
+    def heatmapTable(self, ids=None, timesOfDay=None, moonPhases=None, normalize=False):
+        """
+        Given the same selection as select() and whether to
+        normalize each hour's column to fractions of time
+        spent, returns a pandas dataframe with a row per depth
+        bin and a column per hour that has samples.
+        """
+        counts = self.select(ids, timesOfDay, moonPhases)
+        table = pd.DataFrame(counts, index=pd.Index(self.depthBins, name="Depth Bin"),
+                             columns=pd.Index(HOURS, name="Hour (UTC-10)"))
+        table = table.loc[:, table.sum(axis=0) > 0]
+        if normalize:
+            table = table / table.sum(axis=0)
+        return table
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from aggregation import broadcast_groups, get_group_ids
+from instrumentation import instrument
+
+
+# Dive detection for White Shark Pa'ina tag data. A dive
+# starts when a shark goes deeper than a threshold (50 m by
+# default, the crossing counted by the old
+# get_hourly_dive_frequency) and ends when it comes back up
+# to a shallower end threshold, so depth noise around the
+# threshold doesn't split one dive into many. Dives shorter
+# than a minimum duration (including single samples) are
+# dropped. Each dive is split into descent, bottom and ascent
+# phases, where the bottom phase runs from the first to the
+# last sample within bottom_fraction of the dive's max depth.
+# All sharks are segmented in one linear pass at full
+# resolution.
+
+DIVE_THRESHOLD = 50
+
+# meters above the threshold a dive ends at by default
+DIVE_HYSTERESIS = 5
+
+# shortest dive kept (s), e.g. 6 samples of a 10 s tag
+MIN_DIVE_DURATION = 60
+
+BOTTOM_FRACTION = 0.8
+
+
+@instrument()
+def get_dives(df, threshold=DIVE_THRESHOLD, bottom_fraction=BOTTOM_FRACTION, end_threshold=None,
+              min_duration=MIN_DIVE_DURATION):
+    """
+    Given a dataframe of one or more sharks' rows, with each
+    shark's rows together and in time order, the depth (m) a
+    dive starts below, the fraction of max depth that counts
+    as the bottom phase, the depth (m) a dive ends at or
+    above (None for threshold - DIVE_HYSTERESIS) and the
+    shortest dive kept (s), returns a dataframe with one row
+    per dive of at least two samples: its Id, start and end
+    time, duration, max depth, phase durations and
+    descent/ascent rates (m/s).
+    """
+    if end_threshold is None:
+        end_threshold = threshold - DIVE_HYSTERESIS
+    if end_threshold > threshold:
+        raise ValueError("end_threshold must not be deeper than threshold")
+
+    n = len(df)
+    codes, shark_ids = pd.factorize(df['Id'])
+    depths = df['Depth(m)'].to_numpy(dtype=float)
+    datetimes = df['Datetime (UTC-10)']
+    times = datetimes.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy()
+    seconds = (times - times[0]) / np.timedelta64(1, 's') if n else np.zeros(0)
+
+    new_shark = np.ones(n, dtype=bool)
+    new_shark[1:] = codes[1:] != codes[:-1]
+
+    # each row is in a dive if the last row (of its shark) that
+    # went deeper than threshold or up to end_threshold went
+    # deeper; rows in between (and NaN depths) keep the state
+    positions = np.arange(n)
+    with np.errstate(invalid='ignore'):
+        below_start = depths > threshold
+        above_end = depths <= end_threshold
+    last_change = np.maximum.accumulate(np.where(below_start | above_end | new_shark, positions, 0))
+    in_dive = below_start[last_change]
+    last_of_shark = np.ones(n, dtype=bool)
+    last_of_shark[:-1] = new_shark[1:]
+
+    starts = np.flatnonzero(in_dive & (new_shark | ~np.roll(in_dive, 1)))
+    ends = np.flatnonzero(in_dive & (last_of_shark | ~np.roll(in_dive, -1)))
+
+    if len(starts) == 0:
+        return pd.DataFrame(columns=['Id', 'Dive Start', 'Dive End', 'Duration (s)', 'Max Depth (m)',
+                                     'Descent Duration (s)', 'Bottom Duration (s)', 'Ascent Duration (s)',
+                                     'Descent Rate (m/s)', 'Ascent Rate (m/s)'])
+
+    # rows between the end of one dive and the start of the
+    # next are no deeper than threshold, so reducing from
+    # start to start gives each dive's value
+    max_depths = np.fmax.reduceat(depths, starts)
+    is_start = np.zeros(n, dtype=bool)
+    is_start[starts] = True
+    run_ids = np.cumsum(is_start) - 1
+    is_bottom = in_dive & (depths >= bottom_fraction * max_depths[np.maximum(run_ids, 0)])
+    first_bottom = np.minimum.reduceat(np.where(is_bottom, positions, n), starts)
+    last_bottom = np.maximum.reduceat(np.where(is_bottom, positions, -1), starts)
+
+    descent_sec = seconds[first_bottom] - seconds[starts]
+    ascent_sec = seconds[ends] - seconds[last_bottom]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        descent_rate = np.where(descent_sec > 0, (depths[first_bottom] - depths[starts]) / descent_sec, np.nan)
+        ascent_rate = np.where(ascent_sec > 0, (depths[last_bottom] - depths[ends]) / ascent_sec, np.nan)
+
+    dives = pd.DataFrame({
+        'Id': np.asarray(shark_ids)[codes[starts]],
+        'Dive Start': datetimes.iloc[starts].to_numpy(),
+        'Dive End': datetimes.iloc[ends].to_numpy(),
+        'Duration (s)': seconds[ends] - seconds[starts],
+        'Max Depth (m)': max_depths,
+        'Descent Duration (s)': descent_sec,
+        'Bottom Duration (s)': seconds[last_bottom] - seconds[first_bottom],
+        'Ascent Duration (s)': ascent_sec,
+        'Descent Rate (m/s)': descent_rate,
+        'Ascent Rate (m/s)': ascent_rate,
+        })
+
+    # dropped only now: every dive's rows bound the reductions
+    # of the dive before it
+    keep = (ends > starts) & (dives['Duration (s)'].to_numpy() >= min_duration)
+    return dives[keep].reset_index(drop=True)
+
+
+def get_hourly_dive_frequency(df, dives):
+    """
+    Given a dataframe of one or more sharks' rows and the
+    dive table from get_dives for it, returns a dataframe
+    with the number of dives started in each hour that the
+    shark has samples for (including hours with no dives).
+    """
+    _, hours = get_group_ids(df, "h")
+    dive_hours = pd.MultiIndex.from_arrays([dives['Id'].astype(str),
+                                            pd.DatetimeIndex(dives['Dive Start']).floor("h")])
+    counts = pd.Series(1, index=dive_hours).groupby(level=[0, 1]).sum()
+
+    hour_index = pd.MultiIndex.from_arrays([hours['Id'].astype(str), hours['Bucket Start']])
+    hours['Dives'] = counts.reindex(hour_index, fill_value=0).to_numpy()
+    return hours
+
+
+@instrument()
+def add_hourly_dive_frequency(df, dives):
+    """
+    Given a dataframe of one or more sharks' rows and the
+    dive table from get_dives for it, adds the number of
+    dives started in each row's hour as an "Hourly Dive
+    Frequency (dives/hr)" column.
+    """
+    group_ids, _ = get_group_ids(df, "h")
+    hourly = get_hourly_dive_frequency(df, dives)
+    df['Hourly Dive Frequency (dives/hr)'] = broadcast_groups(hourly['Dives'], group_ids)
+    return df
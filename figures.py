@@ -12,6 +12,14 @@ import re
 import seaborn as sns
 import sys
 
+import aggregation
+import instrumentation
+import summary_stats
+import tag_formats
+import time_of_day
+from depth_cube import DepthHistogramCube
+from depth_density import DepthDensitySummary
+
 
 # Written by Erika Hunting ehunting@stanford.edu for 
 # plotting archival White Shark tag Data for 2022
@@ -21,120 +29,171 @@ import sys
 # processing data #########################################
 def convertUtcToHi(hour):
     """
-    Given an hour in 24 hour clock in UTC, converts to
-    local time Hawaii
+    Given an hour (or array of hours) in 24 hour clock in
+    UTC, converts to local time Hawaii
     """
-    
-    if hour >= 10:
-        return hour - 10
-    return 24 - (10 - hour)
+    return time_of_day.convert_utc_to_hi(hour)
 
 def getStandardizedDatetime(row, originaltzstring):
     originaltz = pytz.timezone(originaltzstring)
     originaldt = dt.datetime(row["Year"], row["Month"], row["Day"], row["Hour"], row["Min"], row["Sec"], 0, originaltz)
     return originaldt.astimezone(pytz.timezone("Pacific/Honolulu"))
-    
-def getTimeOfDay(hour):
 
-    # call api later
-    sunrise = 6
-    sunset = 18
+
+@instrumentation.instrument()
+def getStandardizedDatetimes(df, originaltzstring):
+    """
+    Given a pandas dataframe of corrected archival tag data
+    with Year, Month, Day, Hour, Min and Sec columns and a
+    str of the timezone of the timestamps, returns a tz-aware
+    datetime64 Series in Pacific/Honolulu time. Same values
+    as getStandardizedDatetime, built for all rows at once.
+    """
+    parts = df[["Year", "Month", "Day", "Hour", "Min", "Sec"]]
+    parts = parts.rename(columns={"Year": "year", "Month": "month", "Day": "day",
+                                  "Hour": "hour", "Min": "minute", "Sec": "second"})
     
-    if hour in range(sunrise + 1, sunset - 1):
-        return 'Day'
-    elif hour in range(sunset + 1, 24) or hour in range(0, sunrise - 1):
-        return 'Night'
-    elif hour in range(sunrise - 1, sunrise + 1):
-        return 'Dawn'
-    else:
-        return 'Dusk'
+    originaldts = pd.to_datetime(parts).dt.tz_localize(originaltzstring)
+    return originaldts.dt.tz_convert("Pacific/Honolulu")
+
+
+def getOriginalTimezone(dateColName):
+    """
+    Given the name of the first (Date) column of a corrected
+    archival tag file, returns the str of the timezone its
+    timestamps were recorded in (see tag_formats.py).
+    """
+    return tag_formats.get_tag_format([dateColName]).timezone
+
+
+def getTimeOfDay(hour, sunrise=6, sunset=18):
+    """
+    Given an hour (or array of hours) in Hawaii time and
+    sunrise and sunset hours, returns the time of day
+    ("Dawn," "Day," "Dusk" or "Night") of the hour, or a
+    pandas Categorical of them for an array.
+    """
+    timesOfDay = time_of_day.get_times_of_day(np.atleast_1d(hour), sunrise, sunset)
+    if np.ndim(hour) == 0:
+        return timesOfDay[0]
+    return timesOfDay
 
 
+@instrumentation.instrument()
 def getPlotData(filename):
     """
     Given a filename to corrected archival White Shark tag
     data, returns a pandas dataframe containing data for
     plotting
     """
-    df = pd.read_csv(filename)
-    
-    # Get timezone of date/time
-    dateColName = df.columns[0]
-    originaltz = ''
-    if dateColName == "Date(UTC-8)":
-        originaltz = 'Etc/GMT+8' # why? no one knows
-    elif dateColName == "Date(EST)":
-        originaltz = 'UTC' # Why? EST was mistake
-    elif dateColName == "Date":
-        originaltz = 'UTC'
-    else:
-        raise ValueError("Cannot processes timezone of Date column" + dateColName)
+    # only the needed columns, with Date/Time names and the
+    # timezone of the file's tag format
+    tagFormat, df = tag_formats.read_tag_file(filename)
     
     # Build standard datetime
-    df["Datetime (UTC-10)"] = df.apply(lambda row: getStandardizedDatetime(row, originaltz), axis=1)
+    df["Datetime (UTC-10)"] = getStandardizedDatetimes(df, tagFormat.timezone)
     
     # add hour column
-    df["Hour (UTC-10)"] = df["Datetime (UTC-10)"].apply(lambda x: x.hour)
+    df["Hour (UTC-10)"] = df["Datetime (UTC-10)"].dt.hour
     
     # add time of day
-    df["Time of Day"] = df["Hour (UTC-10)"].apply(getTimeOfDay)
+    df["Time of Day"] = getTimeOfDay(df["Hour (UTC-10)"])
     
     return df
 
 
-def resample(df, sampleRate):
+def resample(df, sampleRate, columns=("Date", "Time", "Depth(m)", "Hour")):
     """
     Given a pandas dataframe and a sample rate, resamples
-    data at given sample rate.
+    data at given sample rate, keeping every sampleRate-th
+    row of the given columns. Columns are strided views of
+    df's data, not copies.
     """
+    return pd.DataFrame({col: df[col].array[::sampleRate] for col in columns}, copy=False)
 
-    #date MM/DD/YYYY
-    dates = list(df["Date"])
-    
-    #time string HH:MM:SS
-    times = list(df["Time"])
 
-    # depth, expressed in meters (m) to the tenths place
-    depths = list(df["Depth(m)"])
-    
-    # hour of the day (0-24)
-    hours = list(df["Hour"])
-    
-    resampledDates = []
-    resampledTimes = []
-    resampledDepths = []
-    resampledHours = []
+def resampleTime(df, period, reducer="first", by=None):
+    """
+    Given a pandas dataframe with a "Datetime (UTC-10)"
+    column, a target sampling period as a pandas frequency
+    string (e.g. "1min", "1h"), a reducer ("first", "mean",
+    "min" or "max") and the column to group sharks by (None
+    if df holds one shark), resamples data to one row per
+    period. "first" keeps the first recorded row of each
+    period with all of its columns; the other reducers
+    return the numeric columns reduced over each period,
+    with "Datetime (UTC-10)" set to the period start. Rows
+    without a datetime (or by value) are dropped.
+    """
+    groupIds, groups = aggregation.get_group_ids(df, period, by)
     
-    i = 0
-    while i < len(times):
-        resampledDates.append(dates[i])
-        resampledTimes.append(times[i])
-        resampledDepths.append(depths[i])
-        resampledHours.append(hours[i])
-        i += sampleRate
+    if reducer == "first":
+        ids, firstRows = np.unique(groupIds, return_index=True)
+        return df.iloc[firstRows[ids >= 0]].reset_index(drop=True)
     
-    d = {
-        'Date': resampledDates,
-        'Time': resampledTimes,
-        'Depth(m)': resampledDepths,
-        'Hour': resampledHours,
-        }
-        
-    return pd.DataFrame(d)
+    columns = [col for col in df.select_dtypes("number").columns if col != by]
+    reduced = aggregation.group_by_ids(df[columns], groupIds).agg(reducer).reset_index(drop=True)
+    groups = groups.rename(columns={"Bucket Start": "Datetime (UTC-10)"})
+    return pd.concat([groups, reduced], axis=1)
+
+
+def downsampleMinMax(df, maxPoints, y="Depth(m)"):
+    """
+    Given a pandas dataframe in time order, a point budget
+    and the column to preserve peaks of, returns at most
+    maxPoints rows of df: the rows with the min and max y in
+    each of maxPoints // 2 equal runs of rows, in their
+    original order (just the first row if maxPoints is 1).
+    Unlike resample, the deepest and shallowest sample of
+    every run is always kept.
+    """
+    n = len(df)
+    if n <= maxPoints:
+        return df
+    if maxPoints < 2:
+        # no room for a min/max pair
+        return df.iloc[:max(maxPoints, 0)]
+    
+    values = df[y].to_numpy(dtype=float)
+    starts = np.unique(np.linspace(0, n, max(maxPoints // 2, 1), endpoint=False).astype(np.int64))
+    isStart = np.zeros(n, dtype=bool)
+    isStart[starts] = True
+    bucketIds = np.cumsum(isStart) - 1
+    positions = np.arange(n)
+    
+    # first row holding each bucket's min and max (NaN rows
+    # are only kept if the whole bucket is NaN)
+    with np.errstate(invalid="ignore"):
+        mins = np.fmin.reduceat(values, starts)
+        maxs = np.fmax.reduceat(values, starts)
+    isMin = (values == mins[bucketIds]) | np.isnan(mins[bucketIds])
+    isMax = (values == maxs[bucketIds]) | np.isnan(maxs[bucketIds])
+    minRows = np.minimum.reduceat(np.where(isMin, positions, n), starts)
+    maxRows = np.minimum.reduceat(np.where(isMax, positions, n), starts)
+    
+    keep = np.unique(np.concatenate([minRows, maxRows]))
+    return df.iloc[keep]
 
 
 # plotting data ###########################################
-def plotDepthTimeScatter(pdArchivalData, Id):
+@instrumentation.instrument()
+def plotDepthTimeScatter(pdArchivalData, Id, maxPoints=None, x="Time"):
     """
     Given a pandas dataframe of corrected archival white
-    shark tag data and a string of the sharks's ID, plots a
-    scatter plot of depth vs time.
+    shark tag data in time order, a string of the sharks's
+    ID, a point budget (None to plot every row) and the
+    column to plot on the x axis, plots a scatter plot of
+    depth vs time. With maxPoints, the rows are downsampled
+    with downsampleMinMax so dive peaks are kept.
     """
     
     y = "Depth(m)"
+    if maxPoints is not None:
+        pdArchivalData = downsampleMinMax(pdArchivalData, maxPoints, y)
+    
     sns.set_theme()
     g = sns.relplot(data=pdArchivalData,
-                x="Time",
+                x=x,
                 y=y,
                 label='Depth (m)')
     
@@ -142,6 +201,7 @@ def plotDepthTimeScatter(pdArchivalData, Id):
     g.fig.suptitle('Depth vs. Time for ' + Id)
     
 
+@instrumentation.instrument()
 def plotDepthTimeViolin(pdArchivalData, numDays, Id):
     """
     Given a pandas dataframe of corrected archival white
@@ -151,91 +211,129 @@ def plotDepthTimeViolin(pdArchivalData, numDays, Id):
     and daytime and nightime depth represented by the
     distributions for numDays.
     """
-    isDay = listDayNight(list(pdArchivalData["Hour"]))
-    
-    # just plot a week's worth of data
-    dates = list(pdArchivalData["Date"])
-    seenDates = []
-    
-    i = 0
-    while len(seenDates) < numDays:
-        date = dates[i]
-        if not date in seenDates:
-            seenDates.append(date)
-        i += 1
-    
-    # convert to pandas dataframe
-    d = {
-        'Date': dates[:i],
-        'Depth(m)': list(pdArchivalData["Depth(m)"])[:i],
-        'Time of Day': isDay[:i]
-        }
-    df = pd.DataFrame(d)
-            
+    dates = pdArchivalData["Date"].to_numpy()
+    
+    # just plot the first numDays dates' worth of data
+    firstDates = pd.unique(dates)[:numDays]
+    inDays = pd.Index(firstDates).get_indexer(dates) >= 0
+    
+    summary = DepthDensitySummary(pdArchivalData["Depth(m)"].to_numpy()[inDays], dates[inDays],
+                                  time_of_day.get_days_nights(pdArchivalData["Hour"].to_numpy()[inDays]), order=firstDates)
+    
     # Apply the default theme
     sns.set_theme()
     
-    g = sns.catplot(data=df, kind="violin", x="Date", y="Depth(m)", hue="Time of Day", split=True)
-    g.fig.autofmt_xdate()
-    g.fig.suptitle('Depth vs. Time for ' + Id)
+    fig, ax = plt.subplots(figsize=(5, 5))
+    plotViolinSummary(summary, ax, split=True)
+    ax.set_xlabel("Date")
+    fig.autofmt_xdate()
+    fig.suptitle('Depth vs. Time for ' + Id)
     
     
+@instrumentation.instrument()
 def plotDepthTimeViolinHours(pdArchivalData, Id):
     """
     Given a pandas dataframe of corrected archival white
-    shark tag data, the number of days from the start of
-    the data, and a string of the shark's ID, plots a
+    shark tag data and a string of the shark's ID, plots a
     violin plot of depth vs time with hours on the x axis
-    for numDays.
+    and daytime and nightime depth as separate violins.
     """
-    isDay = listDayNight(list(pdArchivalData["Hour"]))
-
-    dates = list(pdArchivalData["Date"])
-
-    #time string HH:MM:SS
-    times = list(pdArchivalData["Time"])
+    hours = pdArchivalData["Hour"].to_numpy()
+    summary = DepthDensitySummary(pdArchivalData["Depth(m)"].to_numpy(), hours, time_of_day.get_days_nights(hours))
     
-    # convert to pandas dataframe
-    d = {
-        'Date': dates,
-        'Depth(m)': list(pdArchivalData["Depth(m)"]),
-        'Hour': list(pdArchivalData["Hour"]),
-        'Time of Day': isDay
-        }
-    df = pd.DataFrame(d)
-            
     # Apply the default theme
     sns.set_theme()
     
-    g = sns.catplot(data=df, kind="violin", x="Hour", y="Depth(m)", hue="Time of Day", split=False)
+    fig, ax = plt.subplots(figsize=(5, 5))
+    plotViolinSummary(summary, ax, split=False)
+    ax.set_xlabel("Hour")
+    fig.autofmt_xdate()
+    fig.suptitle('Depth vs. Time for ' + Id)
+
+
+def plotViolinSummary(summary, ax, split=False, width=0.8):
+    """
+    Given a DepthDensitySummary, matplotlib axes, whether to
+    draw the two hues as halves of one violin (split) or as
+    violins side by side, and the width of each category,
+    draws a violin per category and hue from the summary's
+    densities with a bar over the interquartile range and a
+    dot at the median. Densities share one scale, so violins
+    with more spread-out depths are narrower. Side by side
+    violins only dodge the hues a category has samples of.
+    """
+    colors = sns.color_palette()
+    numHues = len(summary.hues)
+    counts = summary.table["Count"].to_numpy().reshape(len(summary.categories), numHues)
+    maxDensity = summary.densities.max() if summary.densities.size else 0
+    labeled = set()
+    
+    for i, category in enumerate(summary.categories):
+        # side by side violins only make room for the hues
+        # this category has samples of
+        present = np.flatnonzero(counts[i] > 0)
+        halfWidth = width / 2 if split else width / (2 * max(len(present), 1))
+        
+        for k, j in enumerate(present):
+            hue = summary.hues[j]
+            row = summary.table.iloc[i * numHues + j]
+            depths, density = summary.density(category, hue)
+            widths = halfWidth * density / maxDensity
+            label = None if hue in labeled else hue
+            labeled.add(hue)
+            
+            if split:
+                # first hue on the left half, second on the right
+                side = -1 if j % 2 == 0 else 1
+                ax.fill_betweenx(depths, i, i + side * widths, color=colors[j % len(colors)], label=label)
+                boxX = i + side * halfWidth / 8
+            else:
+                center = i - width / 2 + halfWidth * (2 * k + 1)
+                ax.fill_betweenx(depths, center - widths, center + widths, color=colors[j % len(colors)],
+                                 label=label)
+                boxX = center
+            
+            ax.vlines(boxX, row["Q0.25"], row["Q0.75"], color=".25", linewidth=3)
+            ax.scatter([boxX], [row["Q0.5"]], color="white", s=8, zorder=3)
     
-    g.fig.autofmt_xdate()
-    g.fig.suptitle('Depth vs. Time for ' + Id)
+    ax.set_xticks(range(len(summary.categories)))
+    ax.set_xticklabels([str(category) for category in summary.categories])
+    ax.set_ylabel("Depth(m)")
+    if numHues > 1:
+        ax.legend(title="Time of Day")
     
     
-def plotHeatMap(pdArchivalData, Id):
+@instrumentation.instrument()
+def plotHeatMap(pdArchivalData, Id, normalize=False):
+    """
+    Given a pandas dataframe of corrected archival white
+    shark tag data and a string of the shark's ID, plots a
+    heatmap of the number of samples (or, if normalize, the
+    fraction of each hour's samples) in each 10 m depth bin
+    by hour of the day.
     """
+    cube = DepthHistogramCube(binSize=10, maxDepth=700).add(pdArchivalData, Id)
+    plotHeatMapCube(cube, Id, normalize=normalize)
+
+
+@instrumentation.instrument()
+def plotHeatMapCube(cube, Id, ids=None, timesOfDay=None, moonPhases=None, normalize=False):
+    """
+    Given a DepthHistogramCube, a string naming the plotted
+    subset, and lists of shark ids, times of day and moon
+    phases to include (None for all), plots a heatmap of
+    depth bin vs hour from the cube's counts.
     """
     
     # Apply the default theme
     sns.set_theme()
-   
-    binSize = 10
-    maxDepth = 700
-    bins = np.arange(0, maxDepth, binSize)
-    pdArchivalData["Depth Bin"] = pd.cut(pdArchivalData["Depth(m)"], bins=bins, labels=bins[:-1])
-#    print(pdArchivalData.head(20))
-    
-    grouped = pdArchivalData.groupby(["Hour (UTC-10)", "Depth Bin"]).size().reset_index(name='count')
-#    print(grouped.head(20))
-    piv = grouped.pivot("Depth Bin", "Hour (UTC-10)", "count")
-#    print(piv.head(10))
     
+    piv = cube.heatmapTable(ids, timesOfDay, moonPhases, normalize)
     ax = sns.heatmap(piv)
+    ax.set_title('Time spent at depth for ' + Id)
     
-    ## normalize column by dividing by num rows
-    ## rename depth bin y axis
     
+@instrumentation.instrument()
 def plotDepthDuration(pdArchivalData, Id):
     """
     """
@@ -256,79 +354,41 @@ def plotDepthDuration(pdArchivalData, Id):
     # compare just day and night
     
 
-def printQuickStats(pdArchivalData, Id):
+def printQuickStats(pdArchivalData, Id, by="Day/Night", ddof=0):
     """
     Given a pandas dataframe of corrected archival white
-    shark tag data and a string of the shark ID, returns
-    the average depth during the day and average depth
-    during the night. Day is defined as 6a-6p Hawaii time.
+    shark tag data, a string of the shark ID, the label
+    column(s) to group by and the delta degrees of freedom
+    of the variance, returns a tidy dataframe of the count,
+    mean, variance, standard deviation, min, max and
+    quartiles of depth for each group. By default rows are
+    split into day and night by the "Hour" column (day is
+    6a-6p Hawaii time) with the population standard
+    deviation, as before; pass e.g. by="Time of Day" and
+    ddof=1 for "Dawn," "Day," "Dusk" and "Night" with the
+    sample standard deviation. Quartiles are approximate:
+    read off a histogram of 0.1 m bins, so within 0.05 m.
     """
-    
-    depths = list(pdArchivalData["Depth(m)"])
-    isDay = listDayNight(list(pdArchivalData["Hour"]))
-    dayDepths = []
-    nightDepths = []
-    
-    for i in range(len(isDay)):
-        if isDay[i] == 'day':
-            dayDepths.append(depths[i])
-        else: # night
-            nightDepths.append(depths[i])
-    
-    print('Quick stats for ', Id,
-    'Daytime \n average depth: ', average(dayDepths),
-    '\n', 'standard deviation: ',
-    np.std(np.array(dayDepths)), '\n'
-    'Night time \n average depth: ', average(nightDepths),
-    '\n', 'standard deviation: ',
-    np.std(np.array(nightDepths)))
+    if by == "Day/Night" and by not in pdArchivalData.columns:
+        pdArchivalData = pdArchivalData.assign(**{by: time_of_day.get_days_nights(pdArchivalData["Hour"])})
+    table = summary_stats.summarize(pdArchivalData, by, ["Depth(m)"], ddof=ddof)
+    table.insert(0, "Id", Id)
+    return table
 
 
-def listDayNight(hours):
-    """
-    Given a list of daytime hours, returns a list of
-    strings of the same length classifing each time as
-    'day' or 'night'.
-    """
-    isDay = []
-    
-    # call api later to get sunset and sunrise but
-    # for now say 6pm - 6am is night
-    for i in range(len(hours)):
-        hour = hours[i]
-        if hour < 18 and hour > 6:
-            isDay.append('day')
-        else: # night
-            isDay.append('night')
-    
-    return isDay
-    
-    
-def average(lst):
-    """
-    Given a list of int, returns the average.
-    """
-    return sum(lst) / len(lst)
-    
-def std(lst):
-    """
-    Given a list of int, returns the standard deviation.
-    """
-    
-    return np.std(np.array(lst))
-    
-
 if __name__ == "__main__":
 
     # enter name of dir_path to make figures for e.g.
     # Erika@erikas-mbp python3.8 figures.py dir_path
+    # (to save every shark's figures to ErikaPlots/ at once
+    # use render_figures.py)
     
     filename = sys.argv[1]
     
     df = getPlotData(filename)
 #    print(pdArchivalDepthData.dtypes)
 #    print(pdArchivalDepthData)
-#    plotDepthTimeScatter(resample(pdArchivalDepthData, 50), filename)
+#    plotDepthTimeScatter(df, filename, maxPoints=4000, x="Datetime (UTC-10)")
 #    print(df.info())
 #    print(len(df[df["Depth(m)"] == 0]))
     plotHeatMap(df, filename)
@@ -338,9 +398,11 @@ if __name__ == "__main__":
     
     # would be interesting to look at nautical almanac for moon cycles
     # there seems to be a monthly periodicity
+    # (periodicity.find_periodic_peaks checks for it against the
+    # 29.53 day lunar cycle)
 #    plotDepthTimeViolin(pdArchivalDepthData, 28, filename) #filename = ID
 #    plotDepthTimeViolinHours(pdArchivalDepthData, filename) #filename
-#    printQuickStats(pdArchivalDepthData, filename)
+#    print(printQuickStats(df, filename))
     
 #    plotDepthDuration(df, filename)
 
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+
+# Positions for White Shark Pa'ina tag data. The state space
+# model (SSM) gives about one position per shark per day
+# (ws_hawaiionly_ssm_archivals); each depth sample is matched
+# to its shark's fixes with a sorted as-of join instead of
+# searching the fixes once per sample, optionally
+# interpolating linearly between the fixes before and after.
+
+POSITION_COLUMNS = ["Latitude", "Longitude"]
+
+
+def load_ssm_positions(ssm, tz="Pacific/Honolulu"):
+    """
+    Given a path to (or dataframe of) SSM positions with
+    eventid, date ("mm/dd/yyyy hh:mm"), latitude and longitude
+    columns, and the timezone of the dates, returns a
+    dataframe of "Id", "Fix Datetime", "Latitude" and
+    "Longitude" sorted by fix time.
+    """
+    if not isinstance(ssm, pd.DataFrame):
+        ssm = pd.read_csv(ssm, usecols=["eventid", "date", "latitude", "longitude"])
+    positions = pd.DataFrame({
+        "Id": ssm["eventid"].astype(str).to_numpy(),
+        "Fix Datetime": pd.to_datetime(ssm["date"], format="%m/%d/%Y %H:%M").dt.tz_localize(tz),
+        "Latitude": ssm["latitude"].to_numpy(dtype=float),
+        "Longitude": ssm["longitude"].to_numpy(dtype=float),
+        })
+    return positions.dropna().sort_values("Fix Datetime", kind="stable").reset_index(drop=True)
+
+
+def _get_seconds(datetimes):
+    # seconds since the epoch of tz-aware datetimes
+    utc = pd.Series(datetimes).dt.tz_convert("UTC").dt.tz_localize(None)
+    return ((utc - pd.Timestamp(0)) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+@instrument()
+def add_positions(df, positions, interpolate=False, tolerance=None):
+    """
+    Given a dataframe of one or more sharks with "Id" and
+    "Datetime (UTC-10)" columns, positions from
+    load_ssm_positions, whether to interpolate linearly
+    between fixes and the largest pd.Timedelta allowed
+    between a sample and its shark's nearest fix (None for
+    any), adds "Latitude" and "Longitude" columns. Without
+    interpolation each sample takes its shark's nearest fix;
+    with it, samples before the first or after the last fix
+    hold that fix. Samples with no usable fix or no Id get
+    NaN.
+    """
+    sample_sec = _get_seconds(df["Datetime (UTC-10)"])
+    codes, shark_ids = pd.factorize(df["Id"])
+    shark_ids = np.asarray(shark_ids).astype(str)
+    # rows without an Id get no position; they go last
+    codes = np.where(codes < 0, len(shark_ids), codes)
+    fix_sec = _get_seconds(positions["Fix Datetime"])
+    fix_ids = positions["Id"].astype(str).to_numpy()
+
+    # rows of each shark together, in time order within it
+    order = np.lexsort((sample_sec, codes))
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(shark_ids) + 1))])
+
+    result = {col: np.full(len(df), np.nan) for col in POSITION_COLUMNS}
+    for code, shark_id in enumerate(shark_ids):
+        fixes = np.flatnonzero(fix_ids == shark_id)
+        if len(fixes) == 0:
+            continue
+        fixes = fixes[np.argsort(fix_sec[fixes], kind="stable")]
+        rows = order[bounds[code]:bounds[code + 1]]
+        times = sample_sec[rows]
+        fix_times = fix_sec[fixes]
+
+        # nearest fix by comparing the fixes either side
+        after = np.clip(np.searchsorted(fix_times, times), 0, len(fixes) - 1)
+        before = np.clip(after - 1, 0, len(fixes) - 1)
+        use_before = np.abs(times - fix_times[before]) <= np.abs(fix_times[after] - times)
+        nearest = np.where(use_before, before, after)
+        usable = np.ones(len(rows), dtype=bool)
+        if tolerance is not None:
+            usable = np.abs(fix_times[nearest] - times) <= pd.Timedelta(tolerance).total_seconds()
+
+        for col in POSITION_COLUMNS:
+            fix_values = positions[col].to_numpy(dtype=float)[fixes]
+            if interpolate:
+                values = np.interp(times, fix_times, fix_values)
+            else:
+                values = fix_values[nearest]
+            result[col][rows] = np.where(usable, values, np.nan)
+
+    for col in POSITION_COLUMNS:
+        df[col] = result[col]
+    return df
@@ -0,0 +1,256 @@
+from collections import deque
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Timing and memory records for the White Shark Pa'ina
+# processing stages and plots. Each call of a function
+# decorated with @instrument() (or each `with stage(...)`
+# block) adds a record of its wall and CPU time, rows, rows
+# per second and memory to an in-process list, tagged with
+# the shark and the enclosing stage. Recording costs tens of
+# microseconds per call (each stage is a whole dataframe
+# operation), so it is on by default; tracemalloc deltas are
+# only recorded while tracemalloc is tracing
+# (trace_memory(True)), since tracing slows allocation.
+# Only the latest MAX_RECORDS records are kept.
+#   print_report()              # seconds, rows/s, memory by stage
+#   write_report("report.json")
+
+ENABLED = True
+
+# records kept, oldest dropped first, so a long session
+# doesn't grow memory without bound
+MAX_RECORDS = 100000
+
+_records = deque(maxlen=MAX_RECORDS)
+
+# open stages, innermost last
+_stack = []
+
+
+def set_enabled(enabled):
+    """
+    Given a bool, turns recording of stages on or off.
+    """
+    global ENABLED
+    ENABLED = enabled
+
+
+def trace_memory(enabled=True):
+    """
+    Given a bool, starts or stops tracemalloc, so stages
+    record the peak and net Python memory they allocated.
+    """
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _get_max_rss_mb():
+    # peak resident set size of this process so far
+    if resource is None:
+        return np.nan
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return max_rss / (1 << 20) if sys.platform == "darwin" else max_rss / (1 << 10)
+
+
+@contextmanager
+def stage(name, shark=None, rows=None):
+    """
+    Given a stage name, the shark it processes (None if not
+    one shark) and the number of rows (None if unknown),
+    records the time and memory of the with block. Yields the
+    record dict, whose "Id" and "Rows" can be set inside the
+    block.
+    """
+    if not ENABLED:
+        yield {}
+        return
+
+    record = {
+        "Stage": name,
+        "Parent": _stack[-1]["record"]["Stage"] if _stack else None,
+        "Id": shark if shark is not None else (_stack[-1]["record"]["Id"] if _stack else None),
+        "Rows": rows,
+        }
+    tracing = tracemalloc.is_tracing()
+    frame = {"record": record, "traced_peak": 0}
+    if tracing:
+        traced_start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    rss_start = _get_max_rss_mb()
+    _stack.append(frame)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _stack.pop()
+        rss_end = _get_max_rss_mb()
+        record.update({
+            "Wall (s)": wall,
+            "CPU (s)": cpu,
+            "Rows/s": record["Rows"] / wall if record["Rows"] is not None and wall > 0 else np.nan,
+            "Peak RSS (MB)": rss_end,
+            "RSS Growth (MB)": rss_end - rss_start,
+            "Traced Peak (MB)": np.nan,
+            "Traced Delta (MB)": np.nan,
+            })
+        if tracing and tracemalloc.is_tracing():
+            # nested stages reset the peak, so theirs are
+            # carried up to this stage
+            traced_end, traced_peak = tracemalloc.get_traced_memory()
+            traced_peak = max(traced_peak, frame["traced_peak"])
+            record["Traced Peak (MB)"] = (traced_peak - traced_start) / (1 << 20)
+            record["Traced Delta (MB)"] = (traced_end - traced_start) / (1 << 20)
+            if _stack:
+                _stack[-1]["traced_peak"] = max(_stack[-1]["traced_peak"], traced_peak)
+        _records.append(record)
+
+
+def _get_rows(value):
+    # rows of a dataframe, series or array argument
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+def _get_shark(arguments):
+    # the Id (or shark_id) argument, else the Id of a
+    # dataframe argument whose first and last rows are the
+    # same shark
+    shark = arguments.get("Id", arguments.get("shark_id"))
+    if isinstance(shark, (str, int, np.integer)):
+        return str(shark)
+    if _stack and _stack[-1]["record"]["Id"] is not None:
+        # stage inherits it; indexing a dataframe costs more
+        # than the rest of the record
+        return None
+    for value in arguments.values():
+        if isinstance(value, pd.DataFrame) and "Id" in value.columns and len(value):
+            first, last = value["Id"].iloc[0], value["Id"].iloc[-1]
+            return str(first) if first == last else None
+    return None
+
+
+def instrument(name=None):
+    """
+    Given a stage name (None for the function's name),
+    returns a decorator recording each call of a function as
+    a stage. Rows are the length of the first dataframe,
+    series or array argument, else of the returned one.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            rows = next((_get_rows(value) for value in arguments.values()
+                         if _get_rows(value) is not None), None)
+            with stage(stage_name, _get_shark(arguments), rows) as record:
+                result = func(*args, **kwargs)
+                if rows is None:
+                    # e.g. a file read: the rows it returned
+                    results = result if isinstance(result, tuple) else (result,)
+                    record["Rows"] = next((_get_rows(value) for value in results
+                                           if _get_rows(value) is not None), None)
+                return result
+        return wrapper
+    return decorator
+
+
+def get_records():
+    """
+    Returns a list of copies of the stage record dicts, at
+    most the latest MAX_RECORDS.
+    """
+    return [dict(record) for record in _records]
+
+
+def add_records(records):
+    """
+    Given a list of stage record dicts (e.g. from a worker
+    process), adds them to this process's records (keeping
+    the latest MAX_RECORDS).
+    """
+    _records.extend(records)
+
+
+def clear_records():
+    """
+    Removes all stage records.
+    """
+    _records.clear()
+
+
+def get_report(by=("Stage",)):
+    """
+    Given the columns to group by ("Stage", "Id", "Parent"),
+    returns a pandas dataframe with a row per group: number
+    of calls, total wall and CPU time, rows, rows per second,
+    and the largest peak RSS, RSS growth and traced peak. A
+    stage's times include those of the stages nested in it.
+    """
+    by = list(by)
+    records = pd.DataFrame(get_records(), columns=["Stage", "Parent", "Id", "Rows", "Wall (s)", "CPU (s)", "Rows/s",
+                                                   "Peak RSS (MB)", "RSS Growth (MB)", "Traced Peak (MB)",
+                                                   "Traced Delta (MB)"])
+    records[by] = records[by].fillna("")
+    groups = records.groupby(by, sort=False)
+    report = groups.agg(**{
+        "Calls": ("Stage", "size"),
+        "Wall (s)": ("Wall (s)", "sum"),
+        "CPU (s)": ("CPU (s)", "sum"),
+        "Peak RSS (MB)": ("Peak RSS (MB)", "max"),
+        "RSS Growth (MB)": ("RSS Growth (MB)", "max"),
+        "Traced Peak (MB)": ("Traced Peak (MB)", "max"),
+        })
+    # stages without row counts (e.g. savefig) get NaN, not 0
+    report.insert(3, "Rows", groups["Rows"].sum(min_count=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        report.insert(4, "Rows/s", report["Rows"] / report["Wall (s)"])
+    return report.reset_index()
+
+
+def write_report(path, by=("Stage",)):
+    """
+    Given a path and the columns to group by, writes every
+    stage record and the get_report summary as JSON.
+    """
+    report = get_report(by)
+    with open(path, "w") as f:
+        json.dump({
+            "records": get_records(),
+            "summary": json.loads(report.to_json(orient="records")),
+            }, f, indent=1, default=float)
+
+
+def print_report(by=("Stage",)):
+    """
+    Given the columns to group by, prints the get_report
+    summary, slowest stages first.
+    """
+    report = get_report(by).sort_values("Wall (s)", ascending=False)
+    print(report.round(3).to_string(index=False))
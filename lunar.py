@@ -0,0 +1,77 @@
+from astral import moon
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+
+# Moon phase for White Shark Pa'ina tag data. astral's
+# moon.phase only changes per calendar date, so it is
+# computed once per unique date into a small lookup table
+# and rows are mapped to it by their date's index.
+
+MOON_PHASES = ["New Moon", "First Quarter", "Full Moon", "Last Quarter"]
+
+# astral.moon.phase runs from 0 (new moon) up to 28
+MOON_CYCLE_DAYS = 28.0
+
+
+def get_moon_phase_name(phase_num):
+    """
+    Given a moon phase number from astral.moon.phase,
+    returns the corresponding moon phase as a string.
+    """
+    if (phase_num >= 0.0) and (phase_num <= 6.99):
+        return 'New Moon'
+    elif (phase_num >= 7.0) and (phase_num <= 13.99):
+        return 'First Quarter'
+    elif (phase_num >= 14.0) and (phase_num <= 20.99):
+        return 'Full Moon'
+    elif (phase_num >= 21.0) and (phase_num <= 27.99):
+        return 'Last Quarter'
+    else:
+        return np.nan
+
+
+def get_illumination(phase_num):
+    """
+    Given a moon phase number (or array of them) from
+    astral.moon.phase, returns the fraction of the moon's
+    disk that is lit, from 0 at new moon to 1 at full moon.
+    """
+    return (1 - np.cos(2 * np.pi * np.asarray(phase_num) / MOON_CYCLE_DAYS)) / 2
+
+
+def build_moon_table(dates):
+    """
+    Given an iterable of dates, returns a pandas dataframe
+    indexed by each unique date with its "Moon Phase (days)"
+    number from astral, "Moon Illumination" fraction and
+    "Moon Phase" name.
+    """
+    dates = pd.DatetimeIndex(pd.unique(pd.DatetimeIndex(dates).normalize())).sort_values()
+    phases = np.array([moon.phase(date.date()) for date in dates], dtype=float)
+    return pd.DataFrame({
+        'Moon Phase (days)': phases,
+        'Moon Illumination': get_illumination(phases),
+        'Moon Phase': pd.Categorical([get_moon_phase_name(p) for p in phases], categories=MOON_PHASES),
+        }, index=dates)
+
+
+@instrument()
+def add_moon_phase(df):
+    """
+    Given a dataframe with a tz-aware "Datetime (UTC-10)"
+    column, adds a categorical "Moon Phase" column and
+    numeric "Moon Phase (days)" and "Moon Illumination"
+    columns for each row's date in Hawaii time.
+    """
+    wall = df["Datetime (UTC-10)"].dt.tz_localize(None).to_numpy()
+    days, day_index = np.unique(wall.astype('datetime64[D]'), return_inverse=True)
+    table = build_moon_table(days)
+
+    df['Moon Phase'] = pd.Categorical.from_codes(table['Moon Phase'].cat.codes.to_numpy()[day_index],
+                                                 categories=MOON_PHASES)
+    df['Moon Phase (days)'] = table['Moon Phase (days)'].to_numpy()[day_index]
+    df['Moon Illumination'] = table['Moon Illumination'].to_numpy()[day_index]
+    return df
@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import aggregation
+
+
+# Power spectra of White Shark Pa'ina tag time series (e.g.
+# hourly mean depth) for finding diel, tidal and lunar
+# cycles in diving. Each shark's series is averaged onto a
+# regular grid (aggregation.py); well covered grids get an
+# FFT periodogram, gappy ones (e.g. the ~1 per hour offshore
+# tags) a Lomb-Scargle periodogram of the filled bins,
+# computed for a block of frequencies at a time as matrix
+# products. Both are one-sided power spectral densities in
+# (units of the series)^2 x hours, so they can be compared.
+# Confidence bands come from averaging smooth_bins
+# neighboring frequencies, which makes the power chi-square
+# with 2 x smooth_bins degrees of freedom.
+
+# periods (h) looked for in the spectra
+TARGET_PERIODS = {
+    "Diel (24 h)": 24.0,
+    "Tidal (12.42 h)": 12.42,
+    "Lunar (29.53 d)": 29.53 * 24,
+    }
+
+# grids with more than this fraction of empty bins use
+# Lomb-Scargle
+MAX_GAP_FRACTION = 0.1
+
+# neighboring frequencies averaged for the confidence bands
+SMOOTH_BINS = 3
+
+CONFIDENCE = 0.95
+
+# Lomb-Scargle frequencies per FFT frequency spacing
+OVERSAMPLE = 4
+
+# matrix entries (frequencies x samples) computed at once by
+# lomb_scargle
+LOMB_SCARGLE_BLOCK = 1 << 22
+
+
+def _detrend(times, values):
+    # values minus their least squares line
+    slope, intercept = np.polyfit(times, values, 1)
+    return values - (slope * times + intercept)
+
+
+def fft_periodogram(values, spacing):
+    """
+    Given an array of values on a regular grid (no NaN) and
+    the grid spacing in hours, returns arrays of frequencies
+    (1/h, without 0) and the one-sided power spectral density
+    of the linearly detrended values.
+    """
+    n = len(values)
+    residuals = _detrend(np.arange(n) * spacing, values)
+    freqs = np.fft.rfftfreq(n, d=spacing)[1:]
+    power = 2 * spacing * np.abs(np.fft.rfft(residuals)[1:]) ** 2 / n
+    return freqs, power
+
+
+def lomb_scargle(times, values, freqs):
+    """
+    Given arrays of sample times (h) and values (no NaN) and
+    an array of frequencies (1/h), returns the Lomb-Scargle
+    power spectral density of the linearly detrended values
+    at each frequency, scaled to match fft_periodogram for
+    regularly sampled values.
+    """
+    times = np.asarray(times, dtype=float)
+    residuals = _detrend(times, np.asarray(values, dtype=float))
+    span = len(times) * np.median(np.diff(times)) if len(times) > 1 else 1.0
+
+    power = np.empty(len(freqs))
+    block = max(1, LOMB_SCARGLE_BLOCK // max(len(times), 1))
+    for start in range(0, len(freqs), block):
+        omega = 2 * np.pi * np.asarray(freqs[start:start + block], dtype=float)[:, None]
+        # time offset that makes the sine and cosine terms
+        # orthogonal (Scargle, 1982)
+        tau = np.arctan2(np.sin(2 * omega * times).sum(axis=1),
+                         np.cos(2 * omega * times).sum(axis=1)) / (2 * omega[:, 0])
+        phases = omega * (times - tau[:, None])
+        cosines, sines = np.cos(phases), np.sin(phases)
+        power[start:start + block] = 0.5 * ((cosines @ residuals) ** 2 / (cosines ** 2).sum(axis=1) +
+                                             (sines @ residuals) ** 2 / (sines ** 2).sum(axis=1))
+    return 2 * (span / len(times)) * power
+
+
+def get_confidence_bands(power, smooth_bins=SMOOTH_BINS, confidence=CONFIDENCE, step=1):
+    """
+    Given an array of power spectral density values, the
+    number of independent neighboring frequencies to average,
+    the confidence level and the number of array entries per
+    independent frequency (e.g. the Lomb-Scargle oversampling),
+    returns arrays of the smoothed power and the lower and
+    upper bounds of its confidence band.
+    """
+    width = max(1, smooth_bins * step)
+    smoothed = np.convolve(power, np.ones(width) / width, mode="same")
+    # entries near the ends average fewer frequencies
+    smoothed /= np.convolve(np.ones(len(power)), np.ones(width) / width, mode="same")
+    dof = 2 * smooth_bins
+    alpha = 1 - confidence
+    return (smoothed,
+            smoothed * dof / stats.chi2.ppf(1 - alpha / 2, dof),
+            smoothed * dof / stats.chi2.ppf(alpha / 2, dof))
+
+
+def get_periodogram(datetimes, values, freq="h", min_period=None, max_period=None, method="auto",
+                    smooth_bins=SMOOTH_BINS, confidence=CONFIDENCE):
+    """
+    Given a Series of tz-aware datetimes and array of values
+    of one shark, a pandas frequency string for the grid the
+    values are averaged onto, the shortest and longest periods
+    (h) to keep, the method ("fft", "lomb-scargle" or "auto"
+    to pick by the grid's empty fraction), the neighboring
+    frequencies averaged and the confidence level, returns a
+    dataframe of "Method", "Frequency (1/h)", "Period (h)",
+    "Power", "CI Low" and "CI High" in increasing frequency,
+    with the frequency "Resolution (1/h)" of the series and
+    the degrees of freedom "DOF" of the smoothed power.
+    """
+    series = pd.DataFrame({"Datetime (UTC-10)": pd.Series(datetimes).reset_index(drop=True),
+                           "Value": np.asarray(values, dtype=float)}).dropna()
+    binned = aggregation.aggregate_by_time(series, ["Value"], freq, "mean", by=None).dropna()
+    binned = binned.sort_values("Bucket Start")
+    spacing = pd.Timedelta(pd.tseries.frequencies.to_offset(freq)).total_seconds() / 3600
+    starts = binned["Bucket Start"]
+    times = ((starts - starts.iloc[0]) / pd.Timedelta(hours=1)).to_numpy() if len(binned) else np.array([])
+    grid = np.rint(times / spacing).astype(np.int64)
+    num_bins = grid[-1] + 1 if len(grid) else 0
+
+    if method == "auto":
+        gap_fraction = 1 - len(grid) / num_bins if num_bins else 1
+        method = "fft" if gap_fraction <= MAX_GAP_FRACTION else "lomb-scargle"
+
+    columns = ["Method", "Frequency (1/h)", "Period (h)", "Power", "CI Low", "CI High", "Resolution (1/h)", "DOF"]
+    if len(grid) < 4:
+        return pd.DataFrame(columns=columns)
+
+    span = num_bins * spacing
+    step = 1
+    if method == "fft":
+        # fill the few empty bins linearly between neighbors
+        filled = np.interp(np.arange(num_bins), grid, binned["Value"].to_numpy())
+        freqs, power = fft_periodogram(filled, spacing)
+    elif method == "lomb-scargle":
+        freqs = np.arange(1, OVERSAMPLE * num_bins // 2) / (OVERSAMPLE * span)
+        power = lomb_scargle(times, binned["Value"].to_numpy(), freqs)
+        step = OVERSAMPLE
+    else:
+        raise ValueError("Unknown periodogram method " + method)
+
+    smoothed, low, high = get_confidence_bands(power, smooth_bins, confidence, step)
+    keep = np.ones(len(freqs), dtype=bool)
+    if min_period is not None:
+        keep &= freqs <= 1 / min_period
+    if max_period is not None:
+        keep &= freqs >= 1 / max_period
+    return pd.DataFrame({
+        "Method": method,
+        "Frequency (1/h)": freqs[keep],
+        "Period (h)": 1 / freqs[keep],
+        "Power": smoothed[keep],
+        "CI Low": low[keep],
+        "CI High": high[keep],
+        "Resolution (1/h)": 1 / span,
+        "DOF": 2 * smooth_bins,
+        }, columns=columns)
+
+
+def get_periodograms(df, column="Depth(m)", by="Id", **kwargs):
+    """
+    Given a pandas dataframe of one or more sharks with a
+    "Datetime (UTC-10)" column, the column to analyze and the
+    column to group sharks by, returns the get_periodogram
+    tables of every shark in one tidy dataframe with the by
+    column first. Other keyword arguments are passed on to
+    get_periodogram.
+    """
+    spectra = []
+    for shark, rows in df.groupby(by, sort=True, observed=True):
+        spectrum = get_periodogram(rows["Datetime (UTC-10)"], rows[column], **kwargs)
+        spectrum.insert(0, by, shark)
+        spectra.append(spectrum)
+    return pd.concat(spectra, ignore_index=True) if spectra else pd.DataFrame()
+
+
+def find_periodic_peaks(spectra, targets=TARGET_PERIODS, window=0.1, confidence=CONFIDENCE, by="Id"):
+    """
+    Given a table from get_periodograms, a dict of cycle name
+    to period (h), the fraction of each period searched on
+    either side, the confidence level and the shark column,
+    returns a dataframe with a row per shark and cycle: the
+    period (h) and power of the strongest frequency in the
+    window with its confidence band, the "Background" noise
+    power estimated from the median from half to twice the
+    period outside the window, the p-value of a peak that
+    high in noise, allowing for the number of independent
+    frequencies searched, and whether it is below
+    1 - confidence. Cycles whose window holds no frequency
+    (series too short) get NaN.
+    """
+    rows = []
+    for shark, spectrum in spectra.groupby(by, sort=True, observed=True):
+        periods = spectrum["Period (h)"].to_numpy()
+        for name, period in targets.items():
+            in_window = np.abs(periods - period) <= window * period
+            around = (periods >= period / 2) & (periods <= period * 2) & ~in_window
+            row = {by: shark, "Cycle": name, "Target Period (h)": period, "Peak Period (h)": np.nan,
+                   "Power": np.nan, "CI Low": np.nan, "CI High": np.nan, "Background": np.nan,
+                   "p-value": np.nan, "Significant": False}
+            if in_window.any():
+                peak = spectrum[in_window].loc[spectrum.loc[in_window, "Power"].idxmax()]
+                dof = peak["DOF"]
+
+                # smoothed power in noise is background x chi2(dof) / dof
+                background = np.nan
+                if around.any():
+                    background = spectrum.loc[around, "Power"].median() * dof / stats.chi2.ppf(0.5, dof)
+                # a peak is the largest of about one value per
+                # resolution step of the window (fewer would
+                # overstate significance, as neighbors overlap)
+                freqs = spectrum.loc[in_window, "Frequency (1/h)"]
+                num_independent = max(1.0, (freqs.max() - freqs.min()) / peak["Resolution (1/h)"])
+                p_single = stats.chi2.sf(dof * peak["Power"] / background, dof)
+                p_value = 1 - (1 - p_single) ** num_independent
+                row.update({
+                    "Peak Period (h)": peak["Period (h)"],
+                    "Power": peak["Power"],
+                    "CI Low": peak["CI Low"],
+                    "CI High": peak["CI High"],
+                    "Background": background,
+                    "p-value": p_value,
+                    "Significant": bool(p_value < 1 - confidence),
+                    })
+            rows.append(row)
+    return pd.DataFrame(rows)
@@ -0,0 +1,179 @@
+import argparse
+import json
+from multiprocessing import Pool
+import os
+from os.path import exists, getsize, join
+
+import matplotlib.pyplot as plt
+
+from cache import get_code_version, get_file_hash, get_key
+from cleaning import filter_csvs, get_filepaths_in_dir, get_shark_ID
+import figures
+from instrumentation import add_records, clear_records, get_records, print_report, stage, write_report
+
+
+# Renders the figures.py plots for every corrected archival
+# tag file in a directory, headless and one file per worker
+# process, e.g.
+# python3 render_figures.py ./data/hawaii_data/original --kinds heatmap scatter
+# Figures are written to <out_dir>/<sharkId>/<kind>.png and a
+# figure is skipped when the sha256 of its input file, kind
+# and plotting code matches the hash it was last rendered
+# from.
+
+# points plotted in the full deployment depth vs time
+# scatter (min/max downsampled)
+SCATTER_MAX_POINTS = 4000
+
+# days plotted in the day violin plot
+VIOLIN_DAYS = 28
+
+FIGURE_DPI = 150
+
+HASHES_FILENAME = "figure_hashes.json"
+
+# modules whose code draws the figures
+FIGURE_MODULES = ["aggregation", "depth_cube", "depth_density", "figures", "summary_stats", "tag_formats",
+                  "time_of_day"]
+
+
+def _plotScatter(df, Id):
+    figures.plotDepthTimeScatter(df, Id, maxPoints=SCATTER_MAX_POINTS, x="Datetime (UTC-10)")
+
+
+def _plotDayViolin(df, Id):
+    figures.plotDepthTimeViolin(df, VIOLIN_DAYS, Id)
+
+
+def _plotHeatMap(df, Id):
+    plt.figure()
+    figures.plotHeatMap(df, Id)
+
+
+def _plotDepthDuration(df, Id):
+    plt.figure()
+    figures.plotDepthDuration(df, Id)
+
+
+PLOT_KINDS = {
+    "scatter": _plotScatter,
+    "day_violin": _plotDayViolin,
+    "hour_violin": figures.plotDepthTimeViolinHours,
+    "heatmap": _plotHeatMap,
+    "depth_duration": _plotDepthDuration,
+    }
+
+
+def get_figure_path(out_dir, shark_id, kind):
+    """
+    Given the output directory, a shark ID and a plot kind,
+    returns the path the figure is written to.
+    """
+    return join(out_dir, shark_id, kind + ".png")
+
+
+def render_tag_file(filename, kinds, out_dir, force=False):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, a list of plot kinds (keys of PLOT_KINDS), the
+    output directory and whether to re-render figures whose
+    input and plotting code haven't changed, renders each
+    kind with a non-interactive backend and returns a list of
+    dicts with the shark ID, kind, figure path and whether it
+    was "rendered" or "skipped".
+    """
+    plt.switch_backend("Agg")
+    shark_id = get_shark_ID(filename)
+    shark_dir = join(out_dir, shark_id)
+    os.makedirs(shark_dir, exist_ok=True)
+
+    hashes_path = join(shark_dir, HASHES_FILENAME)
+    hashes = {}
+    if exists(hashes_path):
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+
+    file_hash = get_file_hash(filename)
+    # this file sets the plot options, e.g. SCATTER_MAX_POINTS
+    code_version = get_key("code", get_code_version(*FIGURE_MODULES), get_file_hash(__file__))
+    results = []
+    df = None
+    with stage("render_tag_file", shark_id):
+        for kind in kinds:
+            path = get_figure_path(out_dir, shark_id, kind)
+            figure_hash = get_key("figure", kind, file_hash, code_version)
+            if not force and hashes.get(kind) == figure_hash and exists(path):
+                results.append({"Id": shark_id, "kind": kind, "path": path, "status": "skipped"})
+                continue
+
+            if df is None:
+                df = figures.getPlotData(filename)
+            PLOT_KINDS[kind](df, shark_id)
+
+            # write then rename so an interrupted run never
+            # leaves a partial figure behind a matching hash
+            tmp_path = path + ".tmp.png"
+            with stage("savefig"):
+                plt.gcf().savefig(tmp_path, dpi=FIGURE_DPI, bbox_inches="tight")
+            plt.close("all")
+            os.replace(tmp_path, path)
+
+            hashes[kind] = figure_hash
+            with open(hashes_path, "w") as f:
+                json.dump(hashes, f, indent=1, sort_keys=True)
+            results.append({"Id": shark_id, "kind": kind, "path": path, "status": "rendered"})
+    return results
+
+
+def _render_tag_file_star(args):
+    # the worker's stage records go back with its results
+    clear_records()
+    results = render_tag_file(*args)
+    return results, get_records()
+
+
+def render_tag_dir(dir_path, kinds=tuple(PLOT_KINDS), out_dir="ErikaPlots", num_workers=None, force=False):
+    """
+    Given a directory of corrected archival White Shark tag
+    files, a list of plot kinds, the output directory, a
+    number of worker processes (default: one per core) and
+    whether to re-render unchanged figures, runs
+    render_tag_file on the files in a process pool. Returns
+    the results of every file in one list.
+    """
+    unknown = [kind for kind in kinds if kind not in PLOT_KINDS]
+    if unknown:
+        raise ValueError("Unknown plot kinds " + ", ".join(unknown))
+
+    files = sorted(filter_csvs(get_filepaths_in_dir(dir_path)))
+    tasks = [(file, list(kinds), out_dir, force) for file in files]
+
+    # largest files first so one big tag doesn't start last
+    tasks.sort(key=lambda task: getsize(task[0]), reverse=True)
+    with Pool(num_workers) as pool:
+        file_results = pool.map(_render_tag_file_star, tasks, chunksize=1)
+
+    results = []
+    for file_result, records in file_results:
+        results.extend(file_result)
+        add_records(records)
+    return sorted(results, key=lambda result: (result["Id"], result["kind"]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Render figures for every tag file in a directory.")
+    parser.add_argument("dir_path", help="directory of corrected archival tag csv files")
+    parser.add_argument("--kinds", nargs="+", default=list(PLOT_KINDS), choices=list(PLOT_KINDS))
+    parser.add_argument("--out", default="ErikaPlots", help="output directory (default: ErikaPlots)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="re-render figures whose input and code haven't changed")
+    parser.add_argument("--report", default=None, help="write stage timings and memory as JSON to this path")
+    args = parser.parse_args()
+
+    for result in render_tag_dir(args.dir_path, args.kinds, args.out, args.workers, args.force):
+        print(result["status"], result["path"])
+
+    print_report(by=("Stage", "Id"))
+    if args.report is not None:
+        write_report(args.report, by=("Stage", "Id"))
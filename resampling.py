@@ -0,0 +1,280 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# Block permutation tests and block bootstrap confidence
+# intervals for contrasts between two groups of White Shark
+# Pa'ina tag data, e.g. day vs night or new vs full moon
+# depths. Consecutive samples are strongly autocorrelated, so
+# each group's samples (in time order) are cut into blocks of
+# block_length samples and whole blocks are resampled. Each
+# block is reduced to a histogram of its values once; a batch
+# of resamples is then a matrix of block weights (index
+# arrays drawn in NumPy), and every statistic is computed
+# from the weighted histograms of the whole batch at once.
+
+# samples per block, e.g. 1 hour at a 10 s sampling period
+BLOCK_LENGTH = 360
+
+# duration of a block when compare_groups sets the samples
+# per block from a shark's sampling period
+BLOCK_SECONDS = 60 * 60
+
+NUM_RESAMPLES = 2000
+
+CONFIDENCE = 0.95
+
+# values are binned this finely before resampling (e.g.
+# 0.1 m of depth), so statistics are within half of it
+BIN_WIDTH = 0.1
+
+# resamples processed together, bounding memory to a few
+# CHUNK_SIZE x (number of bins) matrices
+CHUNK_SIZE = 64
+
+
+def _get_means(hist_a, hist_b, values):
+    return hist_a @ values / hist_a.sum(axis=1), hist_b @ values / hist_b.sum(axis=1)
+
+
+def _get_mean_difference(hist_a, hist_b, values):
+    mean_a, mean_b = _get_means(hist_a, hist_b, values)
+    return mean_a - mean_b
+
+
+def _get_median(hist, values):
+    cumulative = np.cumsum(hist, axis=1)
+    return values[np.argmax(cumulative >= cumulative[:, -1:] / 2, axis=1)]
+
+
+def _get_median_difference(hist_a, hist_b, values):
+    return _get_median(hist_a, values) - _get_median(hist_b, values)
+
+
+def _get_ks_distance(hist_a, hist_b, values):
+    cdf_a = np.cumsum(hist_a, axis=1) / hist_a.sum(axis=1, keepdims=True)
+    cdf_b = np.cumsum(hist_b, axis=1) / hist_b.sum(axis=1, keepdims=True)
+    return np.abs(cdf_a - cdf_b).max(axis=1)
+
+
+def _get_cohens_d(hist_a, hist_b, values):
+    # mean difference over the pooled standard deviation
+    n_a, n_b = hist_a.sum(axis=1), hist_b.sum(axis=1)
+    mean_a, mean_b = _get_means(hist_a, hist_b, values)
+    ss_a = hist_a @ values ** 2 - n_a * mean_a ** 2
+    ss_b = hist_b @ values ** 2 - n_b * mean_b ** 2
+    pooled = np.sqrt(np.maximum(ss_a + ss_b, 0) / (n_a + n_b - 2))
+    return (mean_a - mean_b) / pooled
+
+
+def _get_cliffs_delta(hist_a, hist_b, values):
+    # P(a > b) - P(a < b) over all pairs of samples, the
+    # effect size of the Wilcoxon rank-sum test
+    n_a, n_b = hist_a.sum(axis=1), hist_b.sum(axis=1)
+    cumulative_b = np.cumsum(hist_b, axis=1)
+    below = cumulative_b - hist_b
+    above = n_b[:, None] - cumulative_b
+    return (hist_a * (below - above)).sum(axis=1) / (n_a * n_b)
+
+
+# statistic name: function of the group histograms (one row
+# per resample) and the bin values
+STATISTICS = {
+    "Mean Difference": _get_mean_difference,
+    "Median Difference": _get_median_difference,
+    "KS Distance": _get_ks_distance,
+    "Cohen's d": _get_cohens_d,
+    "Cliff's Delta": _get_cliffs_delta,
+    }
+
+
+class BlockHistograms(object):
+    """
+    Histograms of the values in each block of two groups'
+    samples, stored as a sparse matrix with a row per block
+    and a column per bin. Blocks 0 to num_blocks_a - 1 are
+    group a's and the rest are group b's.
+    """
+
+    def __init__(self, a, b, block_length=BLOCK_LENGTH, bin_width=BIN_WIDTH):
+        a = np.asarray(a, dtype=float)
+        b = np.asarray(b, dtype=float)
+        a, b = a[~np.isnan(a)], b[~np.isnan(b)]
+        self.num_blocks_a = int(np.ceil(len(a) / block_length))
+        self.num_blocks_b = int(np.ceil(len(b) / block_length))
+        self.num_blocks = self.num_blocks_a + self.num_blocks_b
+        if min(self.num_blocks_a, self.num_blocks_b) < 2:
+            raise ValueError("Each group needs at least 2 blocks of " + str(block_length) + " samples")
+
+        blocks = np.concatenate([np.arange(len(a)) // block_length,
+                                 self.num_blocks_a + np.arange(len(b)) // block_length])
+        bin_codes, bins = pd.factorize(np.rint(np.concatenate([a, b]) / bin_width).astype(np.int64), sort=True)
+        self.values = np.asarray(bins) * bin_width
+
+        # duplicate (block, bin) entries are summed into counts
+        self.histograms = sparse.csr_matrix((np.ones(len(blocks)), (blocks, bin_codes)),
+                                            shape=(self.num_blocks, len(self.values)))
+        self.histograms.sum_duplicates()
+
+    def get_histograms(self, weights):
+        """
+        Given a matrix of block weights (one row per resample
+        and a column per block), returns the matrix of the
+        weighted histograms (one row per resample and a column
+        per bin).
+        """
+        return np.asarray(weights @ self.histograms)
+
+    def get_group_weights(self):
+        """
+        Returns the block weights of groups a and b as they
+        were observed, each a one row matrix.
+        """
+        weights_a = np.zeros((1, self.num_blocks))
+        weights_a[0, :self.num_blocks_a] = 1
+        return weights_a, 1 - weights_a
+
+
+def _get_statistics(block_histograms, weights_a, weights_b):
+    # every statistic for a batch of block weights
+    hist_a = block_histograms.get_histograms(weights_a)
+    hist_b = block_histograms.get_histograms(weights_b)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {name: statistic(hist_a, hist_b, block_histograms.values)
+                for name, statistic in STATISTICS.items()}
+
+
+def _iter_chunks(num_resamples, chunk_size):
+    for start in range(0, num_resamples, chunk_size):
+        yield min(chunk_size, num_resamples - start)
+
+
+def get_permutation_statistics(block_histograms, num_resamples=NUM_RESAMPLES, rng=None, chunk_size=CHUNK_SIZE):
+    """
+    Given BlockHistograms, a number of permutations, a numpy
+    random Generator and the permutations processed at once,
+    returns a dict of statistic name to an array of its
+    values when the group labels are shuffled between whole
+    blocks (keeping each group's number of blocks).
+    """
+    rng = np.random.default_rng(rng)
+    results = {name: [] for name in STATISTICS}
+    for size in _iter_chunks(num_resamples, chunk_size):
+        # block indices of group a in each permutation
+        indices = np.argsort(rng.random((size, block_histograms.num_blocks)), axis=1)
+        indices = indices[:, :block_histograms.num_blocks_a]
+        weights_a = np.zeros((size, block_histograms.num_blocks))
+        np.put_along_axis(weights_a, indices, 1, axis=1)
+        for name, values in _get_statistics(block_histograms, weights_a, 1 - weights_a).items():
+            results[name].append(values)
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def get_bootstrap_statistics(block_histograms, num_resamples=NUM_RESAMPLES, rng=None, chunk_size=CHUNK_SIZE):
+    """
+    Given BlockHistograms, a number of bootstrap resamples, a
+    numpy random Generator and the resamples processed at
+    once, returns a dict of statistic name to an array of its
+    values when each group's blocks are drawn with
+    replacement (as many as the group has).
+    """
+    rng = np.random.default_rng(rng)
+    num_blocks_a = block_histograms.num_blocks_a
+    num_blocks_b = block_histograms.num_blocks_b
+    results = {name: [] for name in STATISTICS}
+    for size in _iter_chunks(num_resamples, chunk_size):
+        # block indices drawn for each resample, counted into
+        # weights with one bincount per group
+        rows = np.arange(size)[:, None] * block_histograms.num_blocks
+        indices_a = rng.integers(0, num_blocks_a, (size, num_blocks_a))
+        indices_b = rng.integers(num_blocks_a, block_histograms.num_blocks, (size, num_blocks_b))
+        length = size * block_histograms.num_blocks
+        weights_a = np.bincount((rows + indices_a).ravel(), minlength=length).reshape(size, -1).astype(float)
+        weights_b = np.bincount((rows + indices_b).ravel(), minlength=length).reshape(size, -1).astype(float)
+        for name, values in _get_statistics(block_histograms, weights_a, weights_b).items():
+            results[name].append(values)
+    return {name: np.concatenate(values) for name, values in results.items()}
+
+
+def block_resampling_test(a, b, block_length=BLOCK_LENGTH, num_resamples=NUM_RESAMPLES, confidence=CONFIDENCE,
+                          bin_width=BIN_WIDTH, seed=None, chunk_size=CHUNK_SIZE):
+    """
+    Given two arrays of samples in time order (e.g. day and
+    night depths of one shark), the samples per block, the
+    number of permutations and of bootstrap resamples, the
+    confidence level, the bin width of the values, a random
+    seed and the resamples processed at once, returns a
+    pandas dataframe with a row per statistic (a - b
+    differences of mean and median, KS distance, Cohen's d
+    and Cliff's delta): its observed value, the block
+    bootstrap percentile confidence interval, the two-sided
+    block permutation p-value and the number of resamples.
+    p-values are never 0; the smallest is
+    1 / (num_resamples + 1). The KS distance can't be
+    negative, so its bootstrap interval sits above it for
+    similar groups; read its p-value instead.
+    """
+    rng = np.random.default_rng(seed)
+    block_histograms = BlockHistograms(a, b, block_length, bin_width)
+    observed = _get_statistics(block_histograms, *block_histograms.get_group_weights())
+    permuted = get_permutation_statistics(block_histograms, num_resamples, rng, chunk_size)
+    bootstrapped = get_bootstrap_statistics(block_histograms, num_resamples, rng, chunk_size)
+
+    alpha = 1 - confidence
+    rows = []
+    for name in STATISTICS:
+        value = observed[name][0]
+        extreme = np.sum(np.abs(permuted[name]) >= np.abs(value) - 1e-12)
+        low, high = np.nanquantile(bootstrapped[name], [alpha / 2, 1 - alpha / 2])
+        rows.append({
+            "Statistic": name,
+            "Observed": value,
+            "CI Low": low,
+            "CI High": high,
+            "p-value": (extreme + 1) / (num_resamples + 1),
+            "Resamples": num_resamples,
+            })
+    return pd.DataFrame(rows)
+
+
+def get_block_length(datetimes, block_seconds=BLOCK_SECONDS):
+    """
+    Given a Series of one shark's datetimes in time order and
+    a block duration in seconds, returns the number of
+    samples (at least 1) that span the duration at the
+    shark's median sampling period, e.g. 360 for 1 hour of
+    10 s samples. Returns BLOCK_LENGTH if there are fewer than
+    2 datetimes.
+    """
+    periods = pd.Series(datetimes).diff().dt.total_seconds().to_numpy()
+    periods = periods[periods > 0]
+    if len(periods) == 0:
+        return BLOCK_LENGTH
+    return max(1, int(round(block_seconds / np.median(periods))))
+
+
+def compare_groups(df, by, a, b, column="Depth(m)", time_col="Datetime (UTC-10)", block_length=None,
+                   block_seconds=BLOCK_SECONDS, **kwargs):
+    """
+    Given a pandas dataframe of one shark, the label column
+    to compare by, the labels of the two groups (e.g. "Day"
+    and "Night"), the column compared, the column to put
+    rows in time order by (None if already ordered), the
+    samples per block and the block duration in seconds,
+    returns block_resampling_test of the group a and group b
+    values. Tags sample at different periods, so by default
+    (block_length None) each block spans block_seconds at
+    the shark's median sampling period (get_block_length),
+    or BLOCK_LENGTH samples without a time column. Other
+    keyword arguments are passed on to
+    block_resampling_test.
+    """
+    has_times = time_col is not None and time_col in df.columns
+    if has_times:
+        df = df.sort_values(time_col, kind="stable")
+    if block_length is None:
+        block_length = get_block_length(df[time_col], block_seconds) if has_times else BLOCK_LENGTH
+    labels = df[by].to_numpy()
+    values = df[column].to_numpy(dtype=float)
+    return block_resampling_test(values[labels == a], values[labels == b], block_length, **kwargs)
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+from lunar import MOON_PHASES
+from time_of_day import TIMES_OF_DAY
+
+
+# Canonical in-memory types for the White Shark Pa'ina
+# master dataset: categorical Ids and labels, float32
+# measurements, int8 hours and tz-aware datetimes in Hawaii
+# time. Applied at ingest and again before export, so the
+# combined frame and the Parquet dataset share one schema.
+
+TIMEZONE = "Pacific/Honolulu"
+
+DATETIME_COLS = ["Datetime (UTC-10)"]
+
+# fixed categories so every part of the dataset stores the
+# same dictionary for a label column
+LABEL_CATEGORIES = {
+    "Time of Day": TIMES_OF_DAY,
+    "Time of Day (Astral)": TIMES_OF_DAY,
+    "Moon Phase": MOON_PHASES,
+    }
+
+# label columns whose categories are whatever values occur
+CATEGORY_COLS = ["Id", "Sex"]
+
+INT8_COLS = ["Hour (UTC-10)"]
+
+# float32 keeps about 7 significant digits, far finer than
+# the tags' depth (0.5 m) and temperature (0.05 c) steps;
+# latitude and longitude stay float64
+FLOAT32_COLS = [
+    "Depth(m)", "External Temp (c)", "Shark Length (cm)",
+    "Depth Diff (m)", "Vertical Velocity (m/s)", "Speed (m/s)",
+    "Mean Hourly Depth (m)", "Mean Hourly External Temp (c)", "Mean Hourly Speed (m/s)",
+    "Hourly Diving Ratio", "Hourly Dive Frequency (dives/hr)", "Daily SST Est (c)",
+    "Moon Phase (days)", "Moon Illumination",
+    ]
+
+
+def get_schema_datetimes(values):
+    """
+    Given a Series of datetimes (tz-aware, naive Hawaii wall
+    clock time or objects from a row-wise apply), returns a
+    datetime64[ns, Pacific/Honolulu] Series.
+    """
+    values = pd.Series(values)
+    if values.dtype == object:
+        values = pd.to_datetime(values, utc=True)
+    if values.dt.tz is None:
+        values = values.dt.tz_localize(TIMEZONE)
+    return values.dt.tz_convert(TIMEZONE).astype("datetime64[ns, " + TIMEZONE + "]")
+
+
+@instrument()
+def apply_schema(df):
+    """
+    Given a pandas dataframe of processed tag data, returns a
+    copy with the canonical types for the columns it has:
+    label columns as categoricals (Ids as strings),
+    measurements as float32, hour as int8 and datetimes as
+    datetime64[ns, Pacific/Honolulu]. Other columns are left
+    as they are.
+    """
+    df = df.copy()
+    for col, categories in LABEL_CATEGORIES.items():
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=categories)
+    for col in CATEGORY_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str).astype("category")
+    for col in INT8_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.int8)
+    for col in FLOAT32_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float32)
+    for col in DATETIME_COLS:
+        if col in df.columns:
+            df[col] = get_schema_datetimes(df[col]).array
+    return df
+
+
+def get_memory_report(df, before=None):
+    """
+    Given a pandas dataframe, and optionally the same data
+    before apply_schema, returns a dataframe with each
+    column's dtype, bytes in memory (counting the contents
+    of Python objects) and bytes per row, plus the bytes
+    before and the reduction factor if before is given. The
+    last row is the total.
+    """
+    sizes = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "Dtype": df.dtypes.astype(str),
+        "Bytes": sizes,
+        "Bytes per Row": sizes / max(len(df), 1),
+        })
+    report.loc["Total"] = ["", sizes.sum(), sizes.sum() / max(len(df), 1)]
+
+    if before is not None:
+        before_sizes = before.memory_usage(deep=True, index=False)
+        report["Bytes Before"] = before_sizes.reindex(report.index)
+        report.loc["Total", "Bytes Before"] = before_sizes.sum()
+        report["Reduction (x)"] = report["Bytes Before"] / report["Bytes"]
+    return report
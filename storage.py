@@ -0,0 +1,63 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from instrumentation import instrument
+from schema import apply_schema
+
+
+# Columnar (Parquet) storage for the processed White Shark
+# Pa'ina master dataset. One dataset partitioned by shark
+# Id and Sex replaces master_hawaii.csv, the per-shark CSVs
+# and fem_master.csv/mal_master.csv.
+
+PARTITION_COLS = ["Id", "Sex"]
+
+
+def _partitioning():
+    # keep Ids as strings e.g. '190000400' instead of letting
+    # pyarrow infer ints from the directory names
+    schema = pa.schema([(col, pa.string()) for col in PARTITION_COLS])
+    return ds.partitioning(schema, flavor="hive")
+
+
+@instrument()
+def write_master_dataset(df, path, append=False, part=0):
+    """
+    Given a pandas dataframe of processed tag data for one or
+    more sharks and a directory path, writes the data as a
+    Parquet dataset partitioned by Id and Sex. Partitions for
+    the sharks in df are replaced; others are left alone. If
+    append is True, df is added to the existing partitions as
+    file number part instead (e.g. one file per chunk).
+    """
+    df = apply_schema(df)
+    df["Id"] = df["Id"].astype(str)
+    df["Sex"] = df["Sex"].astype(str)
+
+    existing_data_behavior = "overwrite_or_ignore" if append else "delete_matching"
+    df.to_parquet(path, engine="pyarrow", partition_cols=PARTITION_COLS, index=False,
+                  existing_data_behavior=existing_data_behavior,
+                  basename_template="part-{:05d}-{{i}}.parquet".format(part))
+
+
+@instrument()
+def load_master_dataset(path, columns=None, ids=None, sexes=None):
+    """
+    Given the directory path of a dataset written by
+    write_master_dataset, returns a pandas dataframe of the
+    stored data in the canonical schema (see schema.py). Only
+    the given columns are read, and only
+    partitions matching the given list of shark ids and/or
+    sexes (e.g. ['F']) are opened.
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning=_partitioning())
+
+    row_filter = None
+    if ids is not None:
+        row_filter = ds.field("Id").isin([str(Id) for Id in ids])
+    if sexes is not None:
+        sex_filter = ds.field("Sex").isin(list(sexes))
+        row_filter = sex_filter if row_filter is None else row_filter & sex_filter
+
+    df = dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+    return apply_schema(df)
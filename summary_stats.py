@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+
+# Grouped summary statistics (count, mean, variance, min,
+# max and quantiles) of White Shark Pa'ina tag data in one
+# pass over the rows, e.g. depth by Id x time of day x moon
+# phase. Rows can be added a chunk at a time: counts, means
+# and sums of squared deviations are merged with Chan et
+# al.'s parallel update, and quantiles are read off a
+# fixed-width histogram of each group.
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+# histogram bin width for the quantiles, in the units of
+# the summarized column (e.g. 0.1 m of depth)
+QUANTILE_BIN_WIDTH = 0.1
+
+
+class GroupedStats(object):
+    """
+    Running statistics of columns grouped by one or more
+    label columns. Call update() with each dataframe (or
+    chunk) of rows, then table() for the summary. Quantiles
+    are within half of bin_width of the exact ones (and are
+    the bin midpoint, not interpolated between samples).
+    """
+
+    def __init__(self, by, columns=("Depth(m)",), quantiles=QUANTILES, bin_width=QUANTILE_BIN_WIDTH):
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.columns = [columns] if isinstance(columns, str) else list(columns)
+        self.quantiles = quantiles
+        self.bin_width = bin_width
+        self.keys = pd.DataFrame(columns=self.by)
+        self.stats = {col: pd.DataFrame(columns=["Count", "Mean", "M2", "Min", "Max"], dtype=float)
+                      for col in self.columns}
+        self.histograms = {col: pd.Series(dtype=np.int64) for col in self.columns}
+
+    def _get_group_ids(self, df):
+        # ids of df's groups in self.keys, adding new groups
+        chunk_ids = df.groupby(self.by, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        chunk_keys = df[self.by].iloc[np.unique(chunk_ids, return_index=True)[1]].reset_index(drop=True)
+
+        known = pd.MultiIndex.from_frame(self.keys.astype(object))
+        lookup = known.get_indexer(pd.MultiIndex.from_frame(chunk_keys.astype(object)))
+        new_keys = chunk_keys[lookup < 0]
+        lookup[lookup < 0] = np.arange(len(self.keys), len(self.keys) + len(new_keys))
+        self.keys = pd.concat([self.keys, new_keys], ignore_index=True)
+        return lookup[chunk_ids]
+
+    def update(self, df):
+        """
+        Given a pandas dataframe with the by and summarized
+        columns, adds its rows to the running statistics and
+        returns self.
+        """
+        group_ids = self._get_group_ids(df)
+        for col in self.columns:
+            values = df[col].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            chunk = pd.Series(values[valid]).groupby(group_ids[valid]).agg(["count", "mean", "var", "min", "max"])
+            chunk = pd.DataFrame({
+                "Count": chunk["count"].astype(float),
+                "Mean": chunk["mean"],
+                "M2": chunk["var"].fillna(0) * (chunk["count"] - 1),
+                "Min": chunk["min"],
+                "Max": chunk["max"],
+                })
+            self.stats[col] = self._merge(self.stats[col], chunk)
+
+            bins = np.floor(values[valid] / self.bin_width).astype(np.int64)
+            counts = pd.Series(1, index=pd.MultiIndex.from_arrays([group_ids[valid], bins])).groupby(level=[0, 1]).sum()
+            self.histograms[col] = self.histograms[col].add(counts, fill_value=0) if len(self.histograms[col]) else counts
+        return self
+
+    def _merge(self, old, new):
+        # combine two sets of (count, mean, M2, min, max) by
+        # group id (Chan et al., 1979)
+        old, new = old.align(new, join="outer")
+        old = old.fillna({"Count": 0, "Mean": 0, "M2": 0})
+        new = new.fillna({"Count": 0, "Mean": 0, "M2": 0})
+        count = old["Count"] + new["Count"]
+        delta = new["Mean"] - old["Mean"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = old["Mean"] + delta * new["Count"] / count
+            m2 = old["M2"] + new["M2"] + delta ** 2 * old["Count"] * new["Count"] / count
+        return pd.DataFrame({
+            "Count": count,
+            "Mean": mean,
+            "M2": m2,
+            "Min": np.fmin(old["Min"], new["Min"]),
+            "Max": np.fmax(old["Max"], new["Max"]),
+            })
+
+    def _get_quantiles(self, col):
+        # quantiles of each group from its histogram
+        histogram = self.histograms[col].sort_index()
+        if len(histogram) == 0:
+            return pd.DataFrame(columns=["Q" + str(q) for q in self.quantiles], dtype=float)
+        groups = histogram.index.get_level_values(0).to_numpy()
+        bins = histogram.index.get_level_values(1).to_numpy()
+        counts = histogram.to_numpy(dtype=float)
+
+        # cumulative counts within each group
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        cumulative = np.cumsum(counts)
+        before = np.repeat(np.r_[0, cumulative[starts[1:] - 1]], np.diff(np.r_[starts, len(counts)]))
+        within = cumulative - before
+        totals = np.add.reduceat(counts, starts)
+
+        result = {}
+        for q in self.quantiles:
+            # first bin where the group's cumulative count
+            # reaches q of its total
+            target = np.repeat(q * totals, np.diff(np.r_[starts, len(counts)]))
+            reached = np.where(within >= np.maximum(target, 1), np.arange(len(counts)), len(counts))
+            first = np.minimum.reduceat(reached, starts)
+            result["Q" + str(q)] = (bins[first] + 0.5) * self.bin_width
+        return pd.DataFrame(result, index=groups[starts])
+
+    def table(self, ddof=1):
+        """
+        Given the delta degrees of freedom of the variance (1
+        for the sample variance, 0 for the population
+        variance), returns a tidy pandas dataframe with a row
+        per group and summarized column: the by columns,
+        "Variable", "Count", "Mean", "Variance", "Std", "Min",
+        "Max" and a column per (approximate) quantile.
+        """
+        tables = []
+        for col in self.columns:
+            stats = self.stats[col]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                variance = stats["M2"] / (stats["Count"] - ddof)
+            summary = pd.DataFrame({
+                "Variable": col,
+                "Count": stats["Count"].astype(np.int64),
+                "Mean": stats["Mean"],
+                "Variance": variance,
+                "Std": np.sqrt(variance),
+                "Min": stats["Min"],
+                "Max": stats["Max"],
+                }).join(self._get_quantiles(col))
+            tables.append(self.keys.iloc[summary.index].reset_index(drop=True)
+                          .join(summary.reset_index(drop=True)))
+
+        table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+        return table.sort_values(self.by + ["Variable"], kind="stable").reset_index(drop=True)
+
+
+def summarize(df, by, columns=("Depth(m)",), quantiles=QUANTILES, bin_width=QUANTILE_BIN_WIDTH, ddof=1):
+    """
+    Given a pandas dataframe, the column(s) to group by, the
+    column(s) to summarize, the quantiles to estimate and the
+    histogram bin width for them, and the delta degrees of
+    freedom of the variance, returns the tidy summary table
+    of GroupedStats for df.
+    """
+    return GroupedStats(by, columns, quantiles, bin_width).update(df).table(ddof)
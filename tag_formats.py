@@ -0,0 +1,180 @@
+import csv
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from instrumentation import instrument, stage
+
+
+# Layouts of corrected archival White Shark tag files. Tag
+# files name their Date and Time columns differently (e.g.
+# "Date(UTC-8)", "Date(EST)") and record timestamps in
+# different timezones. Each TagFormat maps a file's columns
+# to one canonical set of names and dtypes and gives the
+# timezone of its timestamps. The format is picked from the
+# header line alone, then only the needed columns are read.
+# A new tag layout is a register_tag_format call, not a new
+# copy of figures.py (see codeGrave).
+
+# canonical columns of a tag file and their dtypes
+TAG_DTYPES = {
+    "Date": str,            # MM/DD/YYYY
+    "Time": str,            # HH:MM:SS
+    "Year": np.int32,
+    "Month": np.int32,
+    "Day": np.int32,
+    "Hour": np.int32,
+    "Min": np.int32,
+    "Sec": np.int32,
+    "Depth(m)": np.float32,
+    "ExtTemp(C)": np.float32,
+    }
+
+TAG_COLUMNS = list(TAG_DTYPES)
+
+# columns every tag file must have for standardized datetimes
+# and depths
+REQUIRED_COLUMNS = ["Year", "Month", "Day", "Hour", "Min", "Sec", "Depth(m)"]
+
+
+class TagFormat(object):
+    """
+    A tag file layout: its name, the timezone its timestamps
+    were recorded in and a dict of canonical column name to
+    the file's column name for the columns named differently.
+    A header is in this format if it has the format's Date
+    column.
+    """
+
+    def __init__(self, name, timezone, columns=None):
+        self.name = name
+        self.timezone = timezone
+        self.columns = dict(columns or {})
+
+    def get_file_column(self, col):
+        """
+        Given a canonical column name, returns the name of the
+        column in files of this format.
+        """
+        return self.columns.get(col, col)
+
+    def matches(self, header):
+        """
+        Given a list of column names, returns whether they are
+        in this format.
+        """
+        return self.get_file_column("Date") in header
+
+    def get_usecols(self, header, columns=TAG_COLUMNS):
+        """
+        Given a header in this format and a list of canonical
+        columns, returns a dict of the file's column names to
+        read to their canonical names, leaving out optional
+        columns the file lacks. Raises ValueError if a
+        required column is missing.
+        """
+        missing = [col for col in REQUIRED_COLUMNS
+                   if col in columns and self.get_file_column(col) not in header]
+        if missing:
+            raise ValueError("Tag file in format " + self.name + " is missing columns " + ", ".join(missing))
+        return {self.get_file_column(col): col for col in columns if self.get_file_column(col) in header}
+
+
+TAG_FORMATS = {}
+
+
+def register_tag_format(tag_format):
+    """
+    Given a TagFormat, adds it to the formats tag files are
+    matched against and returns it.
+    """
+    TAG_FORMATS[tag_format.name] = tag_format
+    return tag_format
+
+
+register_tag_format(TagFormat("UTC", "UTC"))
+
+# why? EST was a mistake, these are UTC
+register_tag_format(TagFormat("EST", "UTC", {"Date": "Date(EST)", "Time": "Time(EST)"}))
+
+# why? no one knows
+register_tag_format(TagFormat("UTC-8", "Etc/GMT+8", {"Date": "Date(UTC-8)", "Time": "Time(UTC-8)"}))
+
+
+def read_header(filename):
+    """
+    Given a filename to a csv file, returns the list of
+    column names on its first line.
+    """
+    with open(filename, newline="") as f:
+        return [col.strip() for col in next(csv.reader(f))]
+
+
+def get_tag_format(header):
+    """
+    Given the list of column names of a tag file, returns the
+    first registered TagFormat it matches. Raises ValueError
+    if it matches none.
+    """
+    for tag_format in TAG_FORMATS.values():
+        if tag_format.matches(header):
+            return tag_format
+    raise ValueError("Cannot processes timezone of Date column " + (header[0] if header else ""))
+
+
+def _read_options(filename, columns, tag_format):
+    # the format and read_csv options for a tag file
+    header = read_header(filename)
+    if tag_format is None:
+        tag_format = get_tag_format(header)
+    usecols = tag_format.get_usecols(header, columns)
+    dtypes = {file_col: TAG_DTYPES[col] for file_col, col in usecols.items()}
+    return tag_format, usecols, dtypes
+
+
+@instrument()
+def read_tag_file(filename, columns=TAG_COLUMNS, tag_format=None):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, a list of canonical columns and its TagFormat (None
+    to tell from the header), returns the file's TagFormat
+    and a pandas dataframe of only those columns, with
+    canonical names and dtypes, read with pyarrow's csv
+    parser.
+    """
+    tag_format, usecols, dtypes = _read_options(filename, columns, tag_format)
+
+    # column types given to pyarrow directly: through
+    # pd.read_csv, str columns are converted after parsing
+    # (slower than the whole parse) and without them Time is
+    # inferred as datetime.time objects
+    column_types = {col: pa.string() if dtype is str else pa.from_numpy_dtype(dtype)
+                    for col, dtype in dtypes.items()}
+    table = pa_csv.read_csv(filename, convert_options=pa_csv.ConvertOptions(
+        include_columns=list(usecols), column_types=column_types))
+    return tag_format, table.to_pandas().rename(columns=usecols)
+
+
+def iter_tag_file(filename, chunk_size, columns=TAG_COLUMNS, tag_format=None):
+    """
+    Given a filename to corrected archival White Shark tag
+    data, a number of rows, a list of canonical columns and
+    its TagFormat (None to tell from the header), yields
+    pandas dataframes of at most chunk_size rows like those
+    of read_tag_file, read with pandas' C parser.
+    """
+    tag_format, usecols, dtypes = _read_options(filename, columns, tag_format)
+    chunks = iter(pd.read_csv(filename, engine="c", usecols=list(usecols), dtype=dtypes, chunksize=chunk_size))
+    while True:
+        # each block's parse is its own stage; the caller's
+        # work on it between yields is not
+        with stage("iter_tag_file") as record:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                chunk = chunk.rename(columns=usecols)[list(usecols.values())]
+            record["Rows"] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
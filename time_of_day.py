@@ -0,0 +1,253 @@
+from astral import LocationInfo
+from astral.sun import sun
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+
+# Time of day ("Dawn," "Day," "Dusk," "Night") labeling
+# for White Shark Pa'ina tag data, either from fixed
+# sunrise/sunset hours for whole arrays at once, or from
+# sun events from the Astral API, computed once per day (or
+# once per day and lat/lon grid cell for per-sample
+# positions) instead of once per sample.
+
+TIMES_OF_DAY = ["Dawn", "Day", "Dusk", "Night"]
+
+DAY_NIGHT = ["Day", "Night"]
+
+# fixed hours (Hawaii time) used when not using Astral
+SUNRISE_HOUR = 6
+SUNSET_HOUR = 18
+
+# hours either side of sunrise/sunset counted as dawn/dusk
+TRANSITION_HOURS = 1
+
+# lat/lon are rounded to this many decimals to key the cache
+SUN_CACHE_DECIMALS = 6
+
+# max number of (date, lat, lon) sun events kept in memory
+SUN_CACHE_SIZE = 16384
+
+# width (degrees) of the lat/lon grid cells per-sample
+# positions are snapped to; sunrise shifts about a minute
+# per 0.25 degrees of longitude
+SUN_CELL_SIZE = 0.25
+
+SUN_EVENTS = ["dawn", "sunrise", "sunset", "dusk"]
+
+
+def get_hours(values):
+    """
+    Given an array or Series of hours, or of datetimes,
+    returns a numpy array of the hour of each value (the
+    int hour of the day for datetimes).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.Series(values).dt.hour.to_numpy()
+    return np.asarray(values)
+
+
+def convert_utc_to_hi(hours):
+    """
+    Given an hour (or array of hours) in 24 hour clock in
+    UTC, returns the hour(s) in Hawaii time (UTC-10).
+    """
+    return (np.asarray(hours) - 10) % 24
+
+
+def get_time_of_day_codes(hours, sunrise=SUNRISE_HOUR, sunset=SUNSET_HOUR, width=TRANSITION_HOURS):
+    """
+    Given an array of hours (or datetimes) in Hawaii time,
+    sunrise and sunset hours and the number of hours either
+    side of them that count as dawn and dusk, returns an
+    int8 numpy array indexing TIMES_OF_DAY: dawn is
+    [sunrise - width, sunrise + width), day up to
+    sunset - width, dusk [sunset - width, sunset + width)
+    and night the rest of [0, 24). Hours outside [0, 24) or
+    missing get -1. With the defaults this is the partition
+    of get_time_of_day in cleaning.py and data_cleaning.ipynb.
+    """
+    h = get_hours(hours)
+    if np.issubdtype(h.dtype, np.integer):
+        # look int hours up in the codes of hours 0-23
+        hour_codes = get_time_of_day_codes(np.arange(24.0), sunrise, sunset, width)
+        in_range = (0 <= h) & (h < 24)
+        return np.where(in_range, hour_codes[np.where(in_range, h, 0)], -1).astype(np.int8)
+
+    h = h.astype(float)
+    conditions = [
+        (sunrise - width <= h) & (h < sunrise + width),
+        (sunrise + width <= h) & (h < sunset - width),
+        (sunset - width <= h) & (h < sunset + width),
+        ((0 <= h) & (h < sunrise - width)) | ((sunset + width <= h) & (h < 24)),
+        ]
+    return np.select(conditions, np.arange(len(TIMES_OF_DAY), dtype=np.int8), default=-1).astype(np.int8)
+
+
+def get_times_of_day(hours, sunrise=SUNRISE_HOUR, sunset=SUNSET_HOUR, width=TRANSITION_HOURS):
+    """
+    Given the same arguments as get_time_of_day_codes,
+    returns a pandas Categorical of "Dawn," "Day," "Dusk" and
+    "Night" labels (NaN for -1 codes).
+    """
+    return pd.Categorical.from_codes(get_time_of_day_codes(hours, sunrise, sunset, width), TIMES_OF_DAY)
+
+
+def get_day_night_codes(hours, sunrise=SUNRISE_HOUR, sunset=SUNSET_HOUR):
+    """
+    Given an array of hours (or datetimes), and sunrise and
+    sunset hours, returns an int8 numpy array indexing
+    DAY_NIGHT: day for hours strictly between sunrise and
+    sunset, night otherwise. Missing hours get -1.
+    """
+    h = get_hours(hours).astype(float)
+    codes = np.where((sunrise < h) & (h < sunset), 0, 1).astype(np.int8)
+    codes[np.isnan(h)] = -1
+    return codes
+
+
+def get_days_nights(hours, sunrise=SUNRISE_HOUR, sunset=SUNSET_HOUR):
+    """
+    Given the same arguments as get_day_night_codes,
+    returns a pandas Categorical of "Day" and "Night"
+    labels.
+    """
+    return pd.Categorical.from_codes(get_day_night_codes(hours, sunrise, sunset), DAY_NIGHT)
+
+
+@lru_cache(maxsize=SUN_CACHE_SIZE)
+def _get_sun_events(date, lat, lon):
+    location = LocationInfo("Honolulu", "Hawaii", "Pacific/Honolulu", lat, lon)
+    s = sun(location.observer, date=date, tzinfo=location.timezone)
+
+    # keep wall clock Hawaii time to the second, like
+    # get_time_of_day_astral does
+    return tuple(pd.Timestamp(s[event].replace(tzinfo=None, microsecond=0)) for event in SUN_EVENTS)
+
+
+def get_sun_events(date, lat, lon):
+    """
+    Given a datetime.date, a latitude and a longitude,
+    returns a tuple of the dawn, sunrise, sunset and dusk
+    times as naive Timestamps in Hawaii wall clock time.
+    Results are cached by date and rounded lat/lon.
+    """
+    return _get_sun_events(date, round(float(lat), SUN_CACHE_DECIMALS), round(float(lon), SUN_CACHE_DECIMALS))
+
+
+def build_sun_table(dates, lat, lon):
+    """
+    Given an iterable of dates (e.g. every date in a shark's
+    deployment), a latitude and a longitude, returns a pandas
+    dataframe indexed by date with a column for each of the
+    dawn, sunrise, sunset and dusk times.
+    """
+    dates = pd.DatetimeIndex(pd.unique(pd.DatetimeIndex(dates).normalize()))
+    events = [get_sun_events(date.date(), lat, lon) for date in dates]
+    return pd.DataFrame(events, index=dates, columns=SUN_EVENTS)
+
+
+def get_sun_times(datetimes, lat, lon, cell_size=SUN_CELL_SIZE, default_lat=None, default_lon=None):
+    """
+    Given a Series of tz-aware datetimes in Hawaii time, a
+    latitude and longitude (either single values or arrays
+    with a position per datetime), the grid cell size in
+    degrees (None for exact positions) and the latitude and
+    longitude of rows with a missing position (None for the
+    mean of the given positions), returns numpy arrays of the
+    sunrise and sunset for each datetime's date and position
+    as naive Hawaii wall clock times. Per-datetime positions
+    are snapped to the center of their grid cell, so sun
+    events are computed once per (date, cell). Rows get NaT
+    only if no position is given at all.
+    """
+    wall = pd.Series(datetimes).dt.tz_localize(None).dt.floor("s")
+    dates = wall.dt.normalize()
+
+    if np.ndim(lat) == 0 and np.ndim(lon) == 0:
+        table = build_sun_table(dates, lat, lon)
+        day_index = table.index.get_indexer(dates)
+        return table["sunrise"].to_numpy()[day_index], table["sunset"].to_numpy()[day_index]
+
+    lats = np.broadcast_to(np.asarray(lat, dtype=float), len(wall))
+    lons = np.broadcast_to(np.asarray(lon, dtype=float), len(wall))
+
+    # rows without a position (no fixes for the shark, or
+    # outside its fixes) use the default location
+    missing = np.isnan(lats) | np.isnan(lons)
+    if missing.any() and not missing.all():
+        default_lat = np.nanmean(lats[~missing]) if default_lat is None else default_lat
+        default_lon = np.nanmean(lons[~missing]) if default_lon is None else default_lon
+    if missing.any() and default_lat is not None and default_lon is not None:
+        lats = np.where(missing, default_lat, lats)
+        lons = np.where(missing, default_lon, lons)
+    if cell_size is not None:
+        lats = (np.floor(lats / cell_size) + 0.5) * cell_size
+        lons = (np.floor(lons / cell_size) + 0.5) * cell_size
+
+    has_position = ~(np.isnan(lats) | np.isnan(lons))
+    row_dates = dates.to_numpy()[has_position]
+    row_lats = lats[has_position]
+    row_lons = lons[has_position]
+
+    # code each (date, lat, lon) one column at a time so the
+    # combined codes stay small
+    key_codes = np.zeros(len(row_dates), dtype=np.int64)
+    for values in (row_dates, row_lats, row_lons):
+        codes, unique_values = pd.factorize(values)
+        key_codes, _ = pd.factorize(key_codes * len(unique_values) + codes)
+
+    # first row of each key, to look up its sun events
+    first_rows = np.zeros(key_codes.max() + 1 if len(key_codes) else 0, dtype=np.int64)
+    first_rows[key_codes[::-1]] = np.arange(len(key_codes))[::-1]
+    events = np.array([get_sun_events(pd.Timestamp(row_dates[i]).date(), row_lats[i], row_lons[i])[1:3]
+                       for i in first_rows], dtype="datetime64[ns]").reshape(-1, 2)
+
+    sunrise = np.full(len(wall), np.datetime64("NaT"), dtype="datetime64[ns]")
+    sunset = sunrise.copy()
+    sunrise[has_position] = events[key_codes, 0]
+    sunset[has_position] = events[key_codes, 1]
+    return sunrise, sunset
+
+
+@instrument()
+def get_times_of_day_astral(datetimes, lat, lon, cell_size=SUN_CELL_SIZE, default_lat=None, default_lon=None):
+    """
+    Given a Series of tz-aware datetimes in Hawaii time
+    (UTC-10), a latitude and a longitude (single values, or
+    arrays e.g. the "Latitude" and "Longitude" columns from
+    geolocation.add_positions), the grid cell size for
+    per-row positions and the latitude and longitude of rows
+    without a position (None for the mean of the given
+    positions), returns a Series of the same length
+    with the time of day for each datetime e.g. "Dawn,"
+    "Day," "Dusk," or "Night." With a single lat/lon, gives
+    the same labels as get_time_of_day_astral in
+    data_cleaning.ipynb.
+    """
+    # wall clock Hawaii time to the second
+    wall = pd.Series(datetimes).dt.tz_localize(None).dt.floor("s")
+    dates = wall.dt.normalize()
+    sunrise, sunset = get_sun_times(datetimes, lat, lon, cell_size, default_lat, default_lon)
+
+    t = wall.to_numpy()
+    midnight = dates.to_numpy()
+    pre_midnight = midnight + np.timedelta64(86399, "s")
+    one_hr = np.timedelta64(1, "h")
+    one_s = np.timedelta64(1, "s")
+
+    # ranges are inclusive of start and stop, checked in the
+    # same order as get_time_of_day_astral
+    conditions = [
+        ((midnight <= t) & (t <= sunrise - one_hr)) | ((sunset + one_hr <= t) & (t <= pre_midnight)),
+        (sunrise - one_hr + one_s <= t) & (t <= sunrise + one_hr),
+        (sunrise + one_hr + one_s <= t) & (t <= sunset - one_hr),
+        (sunset - one_hr + one_s <= t) & (t <= sunset + one_hr - one_s),
+        ]
+    labels = np.select(conditions, ["Night", "Dawn", "Day", "Dusk"], default="")
+
+    result = pd.Series(labels, index=pd.Series(datetimes).index, dtype=object)
+    return result.where(result != "", np.nan)